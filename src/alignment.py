@@ -0,0 +1,166 @@
+"""
+alignment.py
+
+Clock alignment for Stockholm Air Pollution project.
+
+The clocks of the SPS30 sensors and the miniDiSC drift apart. The lag between two sensor
+streams is estimated by cross-correlating them on a common time grid. The correlation for
+every lag is computed with FFTs, so aligning two full-day recordings takes O(n log n).
+The resulting offsets, in seconds, can be passed to the offsets arguments of
+frames.get_sensor_dfs and frames.get_calibrate_df and to the offset argument of frames.get_disc_df.
+"""
+
+################################
+# LIBRARIES
+################################
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import fft
+
+from src.frames import read_sensor_file
+
+################################
+# ALIGNMENT FUNCTIONS
+################################
+
+
+def resample_stream(df, column, start, periods, resolution="1s"):
+    """Returns the mean of column in every bin of a regular time grid, NaN where a bin is empty.
+
+    Args:
+        df (dataframe): Sensor records with a Timestamp column.
+        column (str): Column to resample, e.g. "PM2.5".
+        start (timestamp): Start of the first bin.
+        periods (int): Number of bins.
+        resolution (str, optional): Length of a bin. Defaults to "1s".
+
+    Returns:
+        array: Mean value of every bin.
+    """
+    bins = ((df["Timestamp"] - start) // pd.Timedelta(resolution)).to_numpy()
+    values = df[column].to_numpy(dtype=float)
+
+    keep = (bins >= 0) & (bins < periods) & ~np.isnan(values)
+    sums = np.bincount(bins[keep], weights=values[keep], minlength=periods)
+    counts = np.bincount(bins[keep], minlength=periods)
+
+    with np.errstate(invalid="ignore"):
+        return sums / np.where(counts > 0, counts, np.nan)
+
+
+def cross_correlate(a, b, min_overlap=30):
+    """Correlation of b shifted by every lag against a, computed with FFTs.
+
+    Both series are standardized, and missing values are excluded by normalizing every lag
+    with the number of overlapping values.
+
+    Args:
+        a (array): Reference series on a regular grid, NaN where missing.
+        b (array): Series on the same grid, NaN where missing.
+        min_overlap (int, optional): Fewest overlapping values for a lag to count. Defaults to 30.
+
+    Returns:
+        (array, array): Lags in grid steps, from -(len(a) - 1) to len(b) - 1, and the
+        correlation sum(a[t] * b[t + lag]) / overlap for every lag (NaN below min_overlap).
+    """
+    series = []
+    for x in (a, b):
+        valid = ~np.isnan(x)
+        z = np.where(valid, x - np.nanmean(x), 0)
+        std = np.sqrt(np.sum(z**2) / max(valid.sum(), 1))
+        series.append((z / std if std > 0 else z, valid.astype(float)))
+
+    (za, ma), (zb, mb) = series
+    n = fft.next_fast_len(len(a) + len(b) - 1, real=True)
+
+    def correlate(x, y):
+        full = fft.irfft(np.conj(fft.rfft(x, n)) * fft.rfft(y, n), n)
+        # Negative lags wrap around to the end of the circular correlation
+        return np.concatenate([full[n - len(a) + 1 :], full[: len(b)]])
+
+    numerator = correlate(za, zb)
+    overlap = np.rint(correlate(ma, mb))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = np.where(overlap >= min_overlap, numerator / overlap, np.nan)
+
+    return np.arange(-(len(a) - 1), len(b)), correlation
+
+
+def estimate_lag(a_df, b_df, column="PM2.5", b_column=None, resolution="1s", max_lag=600, min_overlap=30):
+    """Estimates the clock offset of stream b relative to stream a.
+
+    Args:
+        a_df (dataframe): Reference sensor records with a Timestamp column.
+        b_df (dataframe): Sensor records to align, with a Timestamp column.
+        column (str, optional): Column of a_df to correlate. Defaults to "PM2.5".
+        b_column (str, optional): Column of b_df to correlate, e.g. "Number" for a miniDiSC. Defaults to column.
+        resolution (str, optional): Step of the common time grid. Defaults to "1s".
+        max_lag (int, optional): Largest offset searched, in seconds. None searches all lags. Defaults to 600.
+        min_overlap (int, optional): Fewest overlapping grid steps for a lag to count. Defaults to 30.
+
+    Returns:
+        float: Seconds to add to the timestamps of b_df to align it with a_df (NaN if the streams do not overlap).
+    """
+    b_column = b_column or column
+    step = pd.Timedelta(resolution)
+
+    # Common grid spanning both streams
+    start = min(a_df["Timestamp"].min(), b_df["Timestamp"].min()).floor(resolution)
+    stop = max(a_df["Timestamp"].max(), b_df["Timestamp"].max())
+    periods = int((stop - start) // step) + 1
+
+    a = resample_stream(a_df, column, start, periods, resolution)
+    b = resample_stream(b_df, b_column, start, periods, resolution)
+
+    lags, correlation = cross_correlate(a, b, min_overlap)
+
+    if max_lag is not None:
+        correlation = np.where(np.abs(lags) * step.total_seconds() <= max_lag, correlation, np.nan)
+
+    if np.all(np.isnan(correlation)):
+        return np.nan
+
+    # A peak at lag L means that b shows the events of a L steps later
+    return float(-lags[np.nanargmax(correlation)] * step.total_seconds())
+
+
+def estimate_offsets(stream_dfs, column="PM2.5", reference=None, **kwargs):
+    """Estimates the clock offset of every stream relative to a reference stream.
+
+    Args:
+        stream_dfs (dict): Sensor records by label, e.g. by file name.
+        column (str, optional): Column to correlate. Defaults to "PM2.5".
+        reference (str, optional): Label of the reference stream. Defaults to the first label.
+        **kwargs: Arguments passed on to estimate_lag.
+
+    Returns:
+        dict: Seconds to add to the timestamps of every stream, by label (0 for the reference).
+    """
+    reference = reference if reference is not None else next(iter(stream_dfs))
+    reference_df = stream_dfs[reference]
+
+    return {
+        label: 0.0 if label == reference else estimate_lag(reference_df, df, column, **kwargs)
+        for label, df in stream_dfs.items()
+    }
+
+
+def get_time_calibration_offsets(folder="../data/time_calibration", date="2022-01-13", column="PM2.5", **kwargs):
+    """Estimates the clock offset of every SPS30 file in the time calibration folder.
+
+    Args:
+        folder (str, optional): Folder with SPS30 files recorded side by side. Defaults to "../data/time_calibration".
+        date (str, optional): Measurement date in format Y-m-d. Defaults to "2022-01-13".
+        column (str, optional): Column to correlate. Defaults to "PM2.5".
+        **kwargs: Arguments passed on to estimate_offsets and estimate_lag.
+
+    Returns:
+        dict: Seconds to add to the timestamps of every file, by file name, relative to the first file.
+    """
+    file_names = sorted(f for f in os.listdir(folder) if f.lower().endswith(".csv"))
+    stream_dfs = {f: read_sensor_file(f"{folder}/{f}", date) for f in file_names}
+
+    return estimate_offsets(stream_dfs, column, **kwargs)
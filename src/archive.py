@@ -0,0 +1,187 @@
+"""
+archive.py
+
+Session archive for Stockholm Air Pollution project.
+
+A session archive is a single .npz file. Session metadata (date, route, sensors, files and
+station start/stop times) is stored as JSON in the "metadata" member, and the readings of
+each session are stored as typed column arrays in members named "<session id>/<column>".
+The stations of a session share the same arrays and are split by their row counts, so a
+single session can be loaded without decoding the rest of the archive.
+"""
+
+################################
+# LIBRARIES
+################################
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+################################
+# SETTINGS
+################################
+
+# Bump when the archive layout changes
+ARCHIVE_VERSION = 1
+
+# Columns of the readings in sessions.json
+JSON_COLUMNS = ["Timestamp", "Sensor", "Value"]
+
+# One reading in the printed numpy repr of sessions.json, e.g. [Timestamp('2021-10-12 07:50:30') 'A' 1.83]
+READING_PATTERN = re.compile(r"\[Timestamp\('([^']*)'\)\s+'([^']*)'\s+([^\s\]]+)\]")
+
+################################
+# ARCHIVE FUNCTIONS
+################################
+
+
+def write_session_archive(sessions, filepath):
+    """Writes sessions to a session archive.
+
+    Args:
+        sessions (dict): Sessions by session id. Each session holds "date", "route", "sensors",
+            "files" and "stations", where stations maps a station name to a dict with "start",
+            "stop" and "data", a dataframe of readings.
+        filepath (str): Path to the .npz archive.
+    """
+    metadata = {"version": ARCHIVE_VERSION, "sessions": {}}
+    arrays = {}
+
+    for session_id, session in sessions.items():
+        session_id = str(session_id)
+        if "/" in session_id:
+            raise ValueError(f"Session id {session_id} can not contain '/'")
+
+        stations = session["stations"]
+        frames = [station["data"] for station in stations.values()]
+        columns = [str(c) for c in frames[0].columns] if frames else []
+
+        for name, frame in zip(stations, frames):
+            if [str(c) for c in frame.columns] != columns:
+                raise ValueError(f"Station {name} in session {session_id} has different columns")
+
+        info = {key: value for key, value in session.items() if key != "stations"}
+        info["columns"] = columns
+        info["stations"] = [
+            {"name": name, "start": station["start"], "stop": station["stop"], "rows": len(station["data"])}
+            for name, station in stations.items()
+        ]
+        metadata["sessions"][session_id] = info
+
+        # Store each column of all stations as one typed array
+        for column in columns:
+            values = np.concatenate([frame[column].to_numpy() for frame in frames]) if frames else np.array([])
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f"{session_id}/{column}"] = values
+
+    arrays["metadata"] = np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8)
+
+    # Write to a temporary file first so that readers never see a partial archive
+    temp_path = f"{filepath}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(temp_path, **arrays)
+    os.replace(temp_path, filepath)
+
+
+def read_archive_metadata(filepath):
+    """Returns the metadata of all sessions in a session archive, without their readings."""
+    with np.load(filepath, allow_pickle=False) as data:
+        metadata = json.loads(data["metadata"].tobytes().decode("utf-8"))
+
+    return metadata["sessions"]
+
+
+def _build_session(data, info, session_id):
+    """Returns a session dict from the archive metadata and the session's column arrays."""
+    columns = {column: data[f"{session_id}/{column}"] for column in info["columns"]}
+    session = {key: value for key, value in info.items() if key not in ("columns", "stations")}
+    session["stations"] = {}
+
+    start = 0
+    for station in info["stations"]:
+        stop = start + station["rows"]
+        frame = pd.DataFrame(
+            {column: values[start:stop] for column, values in columns.items()}, columns=info["columns"]
+        )
+        session["stations"][station["name"]] = {"start": station["start"], "stop": station["stop"], "data": frame}
+        start = stop
+
+    return session
+
+
+def load_session(filepath, session_id):
+    """Loads a single session from a session archive.
+
+    Only the metadata and the arrays of the requested session are decompressed.
+
+    Args:
+        filepath (str): Path to the .npz archive.
+        session_id (str): Id of the session, e.g. "20211012-1".
+
+    Returns:
+        dict: The session, with station readings as dataframes.
+    """
+    with np.load(filepath, allow_pickle=False) as data:
+        sessions = json.loads(data["metadata"].tobytes().decode("utf-8"))["sessions"]
+
+        if session_id not in sessions:
+            raise KeyError(f"Session {session_id} is not in {filepath}")
+
+        return _build_session(data, sessions[session_id], session_id)
+
+
+def load_session_archive(filepath):
+    """Loads all sessions from a session archive, in the same layout as write_session_archive takes."""
+    with np.load(filepath, allow_pickle=False) as data:
+        sessions = json.loads(data["metadata"].tobytes().decode("utf-8"))["sessions"]
+
+        return {session_id: _build_session(data, info, session_id) for session_id, info in sessions.items()}
+
+
+################################
+# CONVERSION FUNCTIONS
+################################
+
+
+def parse_readings(text):
+    """Parses the printed numpy repr of station readings in sessions.json into a dataframe."""
+    readings = READING_PATTERN.findall(text)
+    timestamps, sensors, values = zip(*readings) if readings else ([], [], [])
+
+    return pd.DataFrame(
+        {
+            "Timestamp": pd.to_datetime(list(timestamps)),
+            "Sensor": np.array(sensors, dtype=str),
+            "Value": np.array(values, dtype=float),
+        },
+        columns=JSON_COLUMNS,
+    )
+
+
+def convert_sessions_json(json_path="../data/sessions/sessions.json", archive_path="../data/sessions/sessions.npz"):
+    """Converts a sessions.json file into a session archive.
+
+    Args:
+        json_path (str, optional): Path to sessions.json. Defaults to "../data/sessions/sessions.json".
+        archive_path (str, optional): Path to the archive to write. Defaults to "../data/sessions/sessions.npz".
+
+    Returns:
+        dict: The converted sessions.
+    """
+    with open(json_path) as f:
+        raw_sessions = json.load(f)
+
+    sessions = {}
+    for session_id, session in raw_sessions.items():
+        sessions[session_id] = {key: value for key, value in session.items() if key != "stations"}
+        sessions[session_id]["stations"] = {
+            name: {"start": station["start"], "stop": station["stop"], "data": parse_readings(station["data"])}
+            for name, station in session["stations"].items()
+        }
+
+    write_session_archive(sessions, archive_path)
+
+    return sessions
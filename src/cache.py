@@ -0,0 +1,210 @@
+"""
+cache.py
+
+On-disk cache of parsed frames for Stockholm Air Pollution project.
+
+Parsed dataframes are stored as one .npz file per source file, with typed
+column arrays. Entries are keyed on the source path, size and modification
+time, so editing or replacing a data file invalidates its entry automatically.
+"""
+
+################################
+# LIBRARIES
+################################
+from datetime import time
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.util import create_folder
+
+################################
+# SETTINGS
+################################
+
+# Folder where cached frames are stored (repository root/.cache)
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+
+# Set to False to disable the cache for every loader
+USE_CACHE = True
+
+# Bump when the cache file layout changes so that old entries are ignored
+CACHE_VERSION = 2
+
+################################
+# CACHE FUNCTIONS
+################################
+
+
+def get_cache_path(kind, paths, *args):
+    """Returns the cache file path for a set of source files.
+
+    Args:
+        kind (str): Name of the loader, e.g. "sensor" or "raw_session".
+        paths (list): Source files the cached frame is parsed from.
+        *args: Extra loader arguments that change the parsed frame.
+
+    Returns:
+        (str, str): Path to the cache file and the prefix shared by all versions of the entry.
+    """
+    # Identify the entry by loader, source paths and arguments
+    name = hashlib.sha1(f"{kind}:{CACHE_VERSION}".encode())
+    for path in paths:
+        name.update(os.path.abspath(path).encode())
+    for arg in args:
+        name.update(repr(arg).encode())
+
+    # Identify the version by file size and modification time
+    version = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        version.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    prefix = f"{kind}-{name.hexdigest()[:16]}"
+
+    return os.path.join(CACHE_FOLDER, f"{prefix}-{version.hexdigest()[:16]}.npz"), prefix
+
+
+def save_frame(df, path):
+    """Saves a dataframe as typed column arrays in a .npz file.
+
+    Numeric columns of the same dtype are stacked into a single 2D block so that loading
+    a frame reads a handful of arrays instead of one array per column. Object columns must
+    hold strings or datetime.time values, otherwise a TypeError is raised.
+    """
+    arrays = {"columns": np.array([str(c) for c in df.columns]), "index": df.index.to_numpy()}
+    kinds = []
+    blocks = {}
+    strings = []
+    nulls = []
+    layout = np.full((len(df.columns), 2), -1)
+
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+
+        if values.dtype != object and not isinstance(df[column].dtype, pd.StringDtype):
+            # Add column to the block of its dtype
+            kinds.append("array")
+            block = blocks.setdefault(values.dtype.str, [])
+            layout[i] = [list(blocks).index(values.dtype.str), len(block)]
+            block.append(values)
+            continue
+
+        null = df[column].isna().to_numpy()
+        items = values[~null]
+
+        if all(isinstance(v, str) for v in items):
+            kinds.append("str")
+        elif all(isinstance(v, time) for v in items):
+            kinds.append("time")
+        else:
+            raise TypeError(f"Column {column} can not be cached")
+
+        # Add column to the string block
+        layout[i] = [-1, len(strings)]
+        strings.append(np.array(["" if n else str(v) for v, n in zip(values, null)], dtype=str))
+        nulls.append(null)
+
+    for j, block in enumerate(blocks.values()):
+        arrays[f"block{j}"] = np.stack(block)
+
+    if strings:
+        arrays["strings"] = np.stack(strings)
+        arrays["nulls"] = np.stack(nulls)
+
+    arrays["kinds"] = np.array(kinds)
+    arrays["layout"] = layout
+
+    np.savez(path, **arrays)
+
+
+def load_frame(path):
+    """Loads a dataframe saved with save_frame."""
+    with np.load(path, allow_pickle=False) as data:
+        columns = data["columns"].tolist()
+        kinds = data["kinds"].tolist()
+        layout = data["layout"]
+        blocks = {}
+        frame = {}
+
+        for i, (column, kind) in enumerate(zip(columns, kinds)):
+            if kind == "array":
+                j, k = layout[i]
+                if j not in blocks:
+                    blocks[j] = data[f"block{j}"]
+                frame[column] = blocks[j][k]
+                continue
+
+            if "strings" not in blocks:
+                blocks["strings"] = data["strings"]
+                blocks["nulls"] = data["nulls"]
+
+            k = layout[i][1]
+            values = blocks["strings"][k].astype(object)
+
+            if kind == "time":
+                values = np.array([time.fromisoformat(v) if v else v for v in values], dtype=object)
+
+            values[blocks["nulls"][k]] = np.nan
+            frame[column] = values
+
+        return pd.DataFrame(frame, columns=columns, index=data["index"], copy=False)
+
+
+def load_cached(kind, paths, loader, *args, use_cache=True):
+    """Returns loader(*args), reading it from the cache when the source files are unchanged.
+
+    Args:
+        kind (str): Name of the loader, used in the cache file name.
+        paths (list): Source files read by the loader.
+        loader (function): Function that parses the source files into a dataframe.
+        *args: Arguments passed on to the loader.
+        use_cache (bool, optional): Set to False to bypass the cache. Defaults to True.
+
+    Returns:
+        dataframe: The parsed dataframe.
+    """
+    if not (use_cache and USE_CACHE):
+        return loader(*args)
+
+    cache_path, prefix = get_cache_path(kind, paths, *args)
+
+    if os.path.exists(cache_path):
+        return load_frame(cache_path)
+
+    df = loader(*args)
+
+    # Remove outdated versions of the entry
+    create_folder(CACHE_FOLDER)
+    for file_name in os.listdir(CACHE_FOLDER):
+        if file_name.startswith(prefix):
+            try:
+                os.remove(os.path.join(CACHE_FOLDER, file_name))
+            except FileNotFoundError:
+                pass
+
+    # Write to a temporary file first so that readers never see a partial entry
+    temp_path = f"{cache_path[:-4]}.{os.getpid()}.tmp.npz"
+
+    try:
+        save_frame(df, temp_path)
+        os.replace(temp_path, cache_path)
+    except TypeError:
+        pass
+
+    return df
+
+
+def load_cached_file(filepath, kind, loader, args=(), use_cache=True):
+    """Shorthand for load_cached(kind, [filepath], loader, filepath, *args), usable with map_parallel."""
+    return load_cached(kind, [filepath], loader, filepath, *args, use_cache=use_cache)
+
+
+def clear_cache():
+    """Removes all cached frames."""
+    if os.path.exists(CACHE_FOLDER):
+        for file_name in os.listdir(CACHE_FOLDER):
+            if file_name.endswith(".npz"):
+                os.remove(os.path.join(CACHE_FOLDER, file_name))
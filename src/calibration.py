@@ -0,0 +1,169 @@
+"""
+calibration.py
+
+Sensor calibration for Stockholm Air Pollution project.
+
+During the calibration measurements (data/calibration_A, _B and _C) all SPS30 sensors measured
+the same air. Every sensor gets a linear, or piecewise linear, correction that maps its readings
+onto the mean of all sensors. Coefficients are stored as a small JSON file and applied to the
+Sensor column of any frame with apply_calibration, or through the calibration argument of the
+loaders in frames.py and merge_sessions.py.
+"""
+
+################################
+# LIBRARIES
+################################
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.util import create_folder
+
+################################
+# SETTINGS
+################################
+
+# Calibration folders and their measurement dates
+CALIBRATION_FOLDERS = {
+    "../data/calibration_A": "2021-12-14",
+    "../data/calibration_B": "2021-10-02",
+    "../data/calibration_C": "2022-01-16",
+}
+
+# Parameters that are corrected
+CALIBRATION_PARAMS = ["PM1.0", "PM2.5", "PM4.0", "PM10", "NC0.5", "NC1.0", "NC2.5", "NC10"]
+
+# Where fitted coefficients are stored
+CALIBRATION_PATH = "../results/sensor_calibration.json"
+
+################################
+# CALIBRATION FUNCTIONS
+################################
+
+
+def calibration_basis(x, knots=()):
+    """Returns the design matrix [1, x, max(x - knot, 0), ...] of a piecewise linear correction."""
+    x = np.asarray(x, dtype=float)
+    return np.column_stack([np.ones_like(x), x] + [np.maximum(x - knot, 0) for knot in knots])
+
+
+def bin_calibration_dfs(calibrate_dfs, params=None, resolution="10s"):
+    """Returns the mean of every sensor in every time bin of the calibration measurements.
+
+    Sensors do not record at exactly the same moments, so readings are averaged in time bins
+    before they are compared.
+
+    Args:
+        calibrate_dfs (dict): Calibration records by folder, e.g. from frames.get_calibration_dfs.
+        params (list, optional): Parameters to bin. Defaults to CALIBRATION_PARAMS.
+        resolution (str, optional): Length of the time bins. Defaults to "10s".
+
+    Returns:
+        dataframe: Mean of params for every (Folder, Bin) row and (parameter, Sensor) column.
+    """
+    params = params or CALIBRATION_PARAMS
+    binned_dfs = {}
+
+    for folder, calibrate_df in calibrate_dfs.items():
+        bins = calibrate_df["Timestamp"].dt.floor(resolution).rename("Bin")
+        columns = [p for p in params if p in calibrate_df.columns]
+        binned_dfs[folder] = calibrate_df.groupby([bins, "Sensor"])[columns].mean().unstack("Sensor")
+
+    return pd.concat(binned_dfs, names=["Folder"])
+
+
+def fit_calibration(calibrate_dfs, params=None, knots=None, resolution="10s", min_points=10):
+    """Fits a correction for every sensor against the cross-sensor mean of the calibration measurements.
+
+    Args:
+        calibrate_dfs (dict): Calibration records by folder, e.g. from frames.get_calibration_dfs.
+        params (list, optional): Parameters to correct. Defaults to CALIBRATION_PARAMS.
+        knots (dict, optional): Break points by parameter for piecewise linear corrections. Defaults to linear.
+        resolution (str, optional): Time bin used to pair the sensors. Defaults to "10s".
+        min_points (int, optional): Fewest time bins a sensor needs to be fitted. Defaults to 10.
+
+    Returns:
+        dict: Calibration with the knots and the coefficients of every sensor, per parameter.
+    """
+    knots = knots or {}
+    binned_df = bin_calibration_dfs(calibrate_dfs, params, resolution)
+    calibration = {"resolution": resolution, "folders": [str(f) for f in calibrate_dfs], "params": {}}
+
+    for param in binned_df.columns.get_level_values(0).unique():
+        param_knots = [float(k) for k in knots.get(param, [])]
+        sensor_df = binned_df[param]
+
+        # Mean of all sensors in time bins measured by at least two sensors
+        reference = sensor_df.mean(axis=1).where(sensor_df.count(axis=1) >= 2)
+
+        coefficients = {}
+        for sensor in sensor_df.columns:
+            valid = sensor_df[sensor].notna() & reference.notna()
+            if valid.sum() < min_points:
+                continue
+
+            X = calibration_basis(sensor_df[sensor][valid], param_knots)
+            coefficients[str(sensor)] = np.linalg.lstsq(X, reference[valid].to_numpy(), rcond=None)[0].tolist()
+
+        calibration["params"][param] = {"knots": param_knots, "sensors": coefficients}
+
+    return calibration
+
+
+def save_calibration(calibration, filepath=CALIBRATION_PATH):
+    """Saves a calibration from fit_calibration as JSON."""
+    folder = os.path.dirname(filepath)
+    if folder:
+        create_folder(folder)
+
+    with open(filepath, "w") as f:
+        json.dump(calibration, f, indent=2)
+
+
+def load_calibration(filepath=CALIBRATION_PATH):
+    """Loads a calibration saved with save_calibration."""
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def apply_calibration(df, calibration, sensor_column="Sensor"):
+    """Applies the correction of every sensor to a dataframe.
+
+    Every parameter is corrected in one vectorized pass: the coefficients are looked up for all
+    rows through the sensor codes. Sensors without coefficients are left unchanged.
+
+    Args:
+        df (dataframe): Records with a sensor column and parameter columns.
+        calibration (dict): Calibration from fit_calibration or load_calibration.
+        sensor_column (str, optional): Column with the sensor names. Defaults to "Sensor".
+
+    Returns:
+        dataframe: Copy of df with corrected parameter columns.
+    """
+    df = df.copy()
+
+    # Number the sensors once, so that coefficients are looked up per distinct sensor
+    codes, sensors = pd.factorize(df[sensor_column])
+    sensors = [str(sensor) for sensor in sensors]
+
+    for param, correction in calibration["params"].items():
+        if param not in df.columns:
+            continue
+
+        knots = correction["knots"]
+
+        # Coefficients of every distinct sensor, and an identity correction for unknown sensors
+        identity = [0.0, 1.0] + [0.0] * len(knots)
+        table = np.array([correction["sensors"].get(sensor, identity) for sensor in sensors] + [identity])
+        coefficients = table[codes].T
+
+        values = df[param].to_numpy(dtype=float)
+        corrected = coefficients[0] + coefficients[1] * values
+        for knot, slope in zip(knots, coefficients[2:]):
+            corrected += slope * np.maximum(values - knot, 0)
+
+        df[param] = corrected
+
+    return df
@@ -0,0 +1,165 @@
+"""
+ensemble.py
+
+Multi-sensor ensembles for Stockholm Air Pollution project.
+
+Streams from several sensors that measured side by side are placed on a shared regular time
+grid as a dense (time x sensor) array with a validity mask. The ensemble mean, spread and the
+deviation of every sensor are computed on the whole array at once.
+"""
+
+################################
+# LIBRARIES
+################################
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from src.alignment import resample_stream
+
+# Dense (time x sensor) values of one parameter, with valid marking the cells that hold readings
+SensorGrid = namedtuple("SensorGrid", ["timestamps", "sensors", "values", "valid", "param"])
+
+################################
+# ENSEMBLE FUNCTIONS
+################################
+
+
+def build_sensor_grid(dfs, param="PM2.5", labels=None, resolution="1s", start=None, stop=None):
+    """Places sensor streams on a shared time grid.
+
+    Args:
+        dfs (list): Sensor records with a Timestamp column, e.g. from get_sensor_dfs.
+        param (str, optional): Parameter to place on the grid. Defaults to "PM2.5".
+        labels (list, optional): Sensor label of every frame. Defaults to the Sensor column of every frame.
+        resolution (str, optional): Step of the grid. Readings in the same step are averaged. Defaults to "1s".
+        start (timestamp, optional): Start of the grid. Defaults to the first reading.
+        stop (timestamp, optional): End of the grid. Defaults to the last reading.
+
+    Returns:
+        SensorGrid: Grid timestamps, sensor labels, (time x sensor) values and validity mask.
+    """
+    if labels is None:
+        labels = [str(df["Sensor"].iloc[0]) if len(df) else str(i) for i, df in enumerate(dfs)]
+
+    step = pd.Timedelta(resolution)
+    start = pd.Timestamp(start if start is not None else min(df["Timestamp"].min() for df in dfs)).floor(resolution)
+    stop = pd.Timestamp(stop if stop is not None else max(df["Timestamp"].max() for df in dfs))
+    periods = int((stop - start) // step) + 1
+
+    values = np.column_stack([resample_stream(df, param, start, periods, resolution) for df in dfs])
+    timestamps = pd.date_range(start, periods=periods, freq=step)
+
+    return SensorGrid(timestamps, list(labels), values, ~np.isnan(values), param)
+
+
+def get_ensemble_df(grid, min_sensors=1):
+    """Returns the ensemble statistics of every time step in a sensor grid.
+
+    Args:
+        grid (SensorGrid): Grid from build_sensor_grid.
+        min_sensors (int, optional): Fewest sensors with a reading for a time step to be kept. Defaults to 1.
+
+    Returns:
+        dataframe: Timestamp, Count (sensors with a reading), Mean, Std (sample std across sensors),
+        Min, Max and Range for every kept time step.
+    """
+    count = grid.valid.sum(axis=1)
+    keep = count >= max(min_sensors, 1)
+    values = grid.values[keep]
+    n = count[keep]
+
+    # Masked sums, so that missing sensors do not count
+    filled = np.where(grid.valid[keep], values, 0)
+    mean = filled.sum(axis=1) / n
+    squares = np.where(grid.valid[keep], (values - mean[:, np.newaxis]) ** 2, 0).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(squares / (n - 1))
+
+    minimum = np.where(grid.valid[keep], values, np.inf).min(axis=1)
+    maximum = np.where(grid.valid[keep], values, -np.inf).max(axis=1)
+
+    return pd.DataFrame(
+        {
+            "Timestamp": grid.timestamps[keep],
+            "Count": n,
+            "Mean": mean,
+            "Std": np.where(n > 1, std, np.nan),
+            "Min": minimum,
+            "Max": maximum,
+            "Range": maximum - minimum,
+        }
+    )
+
+
+def get_deviation_df(grid, min_sensors=2):
+    """Returns the deviation of every sensor from the ensemble mean at the same time step.
+
+    Args:
+        grid (SensorGrid): Grid from build_sensor_grid.
+        min_sensors (int, optional): Fewest sensors with a reading for a time step to be kept. Defaults to 2.
+
+    Returns:
+        (dataframe, dataframe): Mean deviation, mean absolute deviation and number of compared time
+        steps for every sensor, and the deviation of every reading in long format.
+    """
+    count = grid.valid.sum(axis=1)
+    keep = (count >= min_sensors)[:, np.newaxis] & grid.valid
+
+    mean = np.where(grid.valid, grid.values, 0).sum(axis=1) / np.maximum(count, 1)
+    deviation = np.where(keep, grid.values - mean[:, np.newaxis], np.nan)
+
+    with np.errstate(invalid="ignore"):
+        summary_df = pd.DataFrame(
+            {
+                "Mean deviation": np.nanmean(deviation, axis=0),
+                "Mean absolute deviation": np.nanmean(np.abs(deviation), axis=0),
+                "Count": keep.sum(axis=0),
+            },
+            index=pd.Index(grid.sensors, name="Sensor"),
+        )
+
+    rows, columns = np.nonzero(keep)
+    deviation_df = pd.DataFrame(
+        {
+            "Timestamp": grid.timestamps[rows],
+            "Sensor": np.array(grid.sensors, dtype=object)[columns],
+            "Deviation": deviation[rows, columns],
+        }
+    )
+
+    return summary_df, deviation_df
+
+
+def get_ensemble_plot_df(grid, with_mean=True, min_sensors=1):
+    """Returns the readings of a sensor grid in the long format of plots.plot_sensors_over_time.
+
+    Args:
+        grid (SensorGrid): Grid from build_sensor_grid.
+        with_mean (bool, optional): Set to False to leave out the ensemble mean, labelled "Mean". Defaults to True.
+        min_sensors (int, optional): Fewest sensors with a reading for the mean to be drawn. Defaults to 1.
+
+    Returns:
+        dataframe: Timestamp, Sensor and parameter columns, e.g. for plot_sensors_over_time(df, title, grid.param).
+    """
+    rows, columns = np.nonzero(grid.valid)
+    order = np.lexsort((rows, columns))
+
+    plot_df = pd.DataFrame(
+        {
+            "Timestamp": grid.timestamps[rows[order]],
+            "Sensor": np.array(grid.sensors, dtype=object)[columns[order]],
+            grid.param: grid.values[rows[order], columns[order]],
+        }
+    )
+
+    if with_mean:
+        ensemble_df = get_ensemble_df(grid, min_sensors)
+        mean_df = pd.DataFrame(
+            {"Timestamp": ensemble_df["Timestamp"], "Sensor": "Mean", grid.param: ensemble_df["Mean"]}
+        )
+        plot_df = pd.concat([plot_df, mean_df], ignore_index=True)
+
+    return plot_df
@@ -10,15 +10,169 @@ Session functions for Stockholm Air Pollution project.
 import pandas as pd
 import numpy as np
 import re
+from collections import namedtuple
+from functools import partial
 
 from src.util import *
+from src.cache import load_cached, load_cached_file
+from src.calibration import CALIBRATION_FOLDERS, apply_calibration
+
+# Offset from SPS30 clock time to local time
+SENSOR_TIME_OFFSET = timedelta(hours=2)
+
+# Seconds added to miniDiSC timestamps, measured against the SPS30 sensors (see alignment.py)
+DISC_TIME_OFFSET = 60
+
+# Metadata from the bracketed header of a miniDiSC file
+DiscHeader = namedtuple("DiscHeader", ["tool_version", "serial_number", "firmware", "start_date", "start_time"])
+
+################################
+# FILE READERS
+################################
+
+
+def read_sensor_file(filepath, date, offset=SENSOR_TIME_OFFSET):
+    """Reads a single SPS30 file and adds a timestamp column, shifted by offset."""
+    df = pd.read_csv(filepath, skiprows=1)
+    df["Timestamp"] = format_times(date, df["Time"], offset)
+
+    return df
+
+
+def read_disc_file(filepath):
+    """Reads a miniDiSC file in a single pass.
+
+    The bracketed header is parsed into a DiscHeader and the tab separated body is read
+    with native decimal comma parsing, so all data columns are floats.
+
+    Returns:
+        (DiscHeader, dataframe): File metadata and measurements, Time in seconds from file start.
+    """
+    header = {}
+
+    with open(filepath) as f:
+        # Read bracketed header lines until the empty line before the data
+        for line in f:
+            line = line.strip()
+
+            if not line:
+                break
+
+            match = re.search(r"tool version (\S+)", line)
+            if match:
+                header["tool_version"] = match.group(1)
+
+            match = re.search(r"miniDiSC (SN\d+) running firmware ([\d,.]+)", line)
+            if match:
+                header["serial_number"] = match.group(1)
+                header["firmware"] = match.group(2).replace(",", ".")
+
+            match = re.search(r"start date: (\d{4})\.(\d{2})\.(\d{2})", line)
+            if match:
+                header["start_date"] = "-".join(match.groups())
+
+            match = re.search(r"start time: (\d{2}:\d{2}:\d{2})", line)
+            if match:
+                header["start_time"] = match.group(1)
+
+        # Read data from the rest of the file
+        disc_df = pd.read_csv(f, sep="\t", decimal=",")
+
+    disc_df = disc_df.iloc[:, :-1]  # remove last (empty) column
+
+    return DiscHeader(**{field: header.get(field) for field in DiscHeader._fields}), disc_df
+
+
+def read_raw_session_file(filepath):
+    """Reads a single raw session file and converts its timestamp column into datetime."""
+    raw_df = pd.read_csv(filepath, index_col=0)
+    raw_df["Timestamp"] = pd.to_datetime(raw_df["Timestamp"], format="%Y-%m-%d %H:%M:%S")
+
+    return raw_df
+
+
+def compute_sessions(raw_session_df, disc=False):
+    """Takes the median value for every station record in one or more raw sessions.
+
+    Medians are computed per sensor with one grouped selection over (Session Id, Station, Sensor)
+    and then averaged over the sensors at every station.
+
+    Returns:
+        dataframe: One row per session and station, in order of appearance.
+    """
+    keys = ["Session Id", "Station"]
+    params = ["Number"] if disc else ["PM2.5", "NC2.5"]
+
+    # Sensor names are read as int when a file only has numbered sensors
+    raw_session_df = raw_session_df.assign(Sensor=raw_session_df["Sensor"].astype(str))
+
+    # Get all stations in order of appearance
+    session_df = raw_session_df[keys].drop_duplicates().reset_index(drop=True)
+    stations = pd.MultiIndex.from_frame(session_df)
+
+    # Get median timestamp
+    timestamps = get_middle_values(raw_session_df, keys, "Timestamp").astype(str)
+    session_df["Timestamp"] = timestamps.reindex(stations).to_numpy()
+    session_df["Date"] = session_df["Timestamp"].str[:10]
+    session_df["Time"] = pd.to_datetime(session_df["Timestamp"], format="%Y-%m-%d %H:%M:%S").dt.time
+
+    # Get median for every sensor and take the mean over all sensors at a station
+    for param in params:
+        sensor_medians = get_middle_values(raw_session_df, keys + ["Sensor"], param)
+
+        # Left-align the sensor medians of every station in a (station x sensor) matrix and sum
+        # the rows in the same way as np.mean, so results match a per-station mean exactly
+        codes, station_index = pd.factorize(sensor_medians.index.droplevel("Sensor"))
+        position = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+
+        medians = np.zeros((len(station_index), position.max() + 1))
+        medians[codes, position] = sensor_medians.to_numpy(dtype=float)
+        means = medians.sum(axis=1) / np.bincount(codes)
+
+        session_df[param] = pd.Series(means, index=station_index).reindex(stations).to_numpy()
+
+    # Combine sensors into single label
+    sensors = raw_session_df[keys + ["Sensor"]].drop_duplicates().sort_values("Sensor")
+    sensors_label = sensors["Sensor"].groupby([sensors[k] for k in keys]).agg("".join)
+    session_df["Sensors"] = sensors_label.reindex(stations).to_numpy()
+
+    return session_df[["Session Id", "Timestamp", "Date", "Time", "Station"] + params + ["Sensors"]]
+
+
+def compute_session_file(filepath, disc=False, calibration=None):
+    """Reads a single raw session file and takes the median value for every station record.
+
+    Sensor values are corrected with calibration (see calibration.py) first when it is given.
+    """
+    raw_session_df = pd.read_csv(filepath)
+
+    if calibration:
+        raw_session_df = apply_calibration(raw_session_df, calibration)
+
+    return compute_sessions(raw_session_df, disc)
+
 
 ################################
 # FRAMES FUNCTIONS
 ################################
 
 
-def get_sensor_dfs(date, sensors, period, use_all=False):
+def get_sensor_dfs(date, sensors, period, use_all=False, use_cache=True, calibration=None, offsets=None):
+    """Loads the SPS30 files of a date folder.
+
+    Args:
+        date (str): Date folder in ../data/sensor_data, in format Y-m-d.
+        sensors (str): Sensors to load, e.g. "ABC".
+        period (str): Period to load, e.g. "AM" or "PM".
+        use_all (bool, optional): Set to True to load every file in the folder. Defaults to False.
+        use_cache (bool, optional): Set to False to bypass the frame cache. Defaults to True.
+        calibration (dict, optional): Corrections to apply, see calibration.py. Defaults to None.
+        offsets (dict, optional): Seconds added to the timestamps of a file, by file name (see alignment.py).
+            Defaults to None.
+
+    Returns:
+        (list, list, list): Dataframes, sensor labels and file names.
+    """
     # Load data
     dfs = []
     labels = []
@@ -37,12 +191,20 @@ def get_sensor_dfs(date, sensors, period, use_all=False):
 
     # Add timestamps column
     for file_name in data_files:
-        df = pd.read_csv(f"../data/sensor_data/{date}/{file_name}", skiprows=1)
-        df["Timestamp"] = df["Time"].apply(lambda x: format_time(date, x) + timedelta(hours=2))
+        filepath = f"../data/sensor_data/{date}/{file_name}"
+        df = load_cached(
+            "sensor", [filepath], read_sensor_file, filepath, date, SENSOR_TIME_OFFSET, use_cache=use_cache
+        )
 
         # Add label column
         df["Sensor"] = file_name[0]
 
+        if offsets and file_name in offsets:
+            df["Timestamp"] += pd.to_timedelta(offsets[file_name], unit="s")
+
+        if calibration:
+            df = apply_calibration(df, calibration)
+
         dfs.append(df)
 
         labels.append(file_name.split("-")[0])
@@ -50,39 +212,29 @@ def get_sensor_dfs(date, sensors, period, use_all=False):
     return dfs, labels, data_files
 
 
-def get_disc_df(date, filepath, offset=60):
-    """[summary]
+def get_disc_df(date, filepath, offset=DISC_TIME_OFFSET):
+    """Loads a miniDiSC file and adds absolute timestamps.
+
+    Args:
+        date (str): Measurement date in format Y-m-d. None uses the start date in the file header.
+        filepath (str): Path to miniDiSC file.
+        offset (int, optional): Seconds added to every timestamp due to calibration (see alignment.py).
+            Defaults to DISC_TIME_OFFSET.
 
     Returns:
         dataframe:
     """
-
-    def fix_timestamp(x):
-        if ".500" in str(x):
-            return datetime.strptime(str(x)[0:19], "%Y-%m-%d %H:%M:%S")
-        else:
-            return x
-
-    disc_df = pd.read_csv(filepath, sep="\t", skiprows=5)
-    disc_df = disc_df.iloc[:, :-1]  # remove last column
-    disc_df["Time"] = disc_df["Time"].apply(lambda x: float(x.replace(",", ".")))  # use . as decimal delimiter
-
-    # Get start time
-    with open(filepath) as f:
-        contents = f.readlines()
-
-    match = re.search(r"\d{2}:\d{2}:\d{2}", contents[3])
-    start_time = match.group()
+    header, disc_df = read_disc_file(filepath)
 
     # Add timestamp column
-    str_time = date + " " + start_time
-    initial_timestamp = datetime.strptime(str_time, "%Y-%m-%d %H:%M:%S")
+    initial_timestamp = pd.Timestamp(f"{date or header.start_date} {header.start_time}")
 
-    # Get absolute time and offset 60 due to calibration
-    disc_df["Timestamp"] = disc_df["Time"].apply(lambda x: add_secs(initial_timestamp, x + offset))
+    # Get absolute time and offset due to calibration
+    timestamps = initial_timestamp + pd.to_timedelta(disc_df["Time"] + offset, unit="s")
 
-    # Fix timestamps to whole seconds
-    disc_df["Timestamp"] = disc_df["Timestamp"].apply(lambda x: fix_timestamp(x))
+    # Fix half seconds to whole seconds
+    half_second = timestamps.dt.microsecond // 1000 == 500
+    disc_df["Timestamp"] = timestamps.where(~half_second, timestamps.dt.floor("s"))
 
     # Add sensor column
     disc_df["Sensor"] = "DiSC"
@@ -90,31 +242,24 @@ def get_disc_df(date, filepath, offset=60):
     return disc_df
 
 
-def combine_raw_session_dfs(data_folder="../data/sessions/Sensirion", output_name=False):
-    """Combines all raw station records into one dataframe and returns it."""
-
-    # Store all raw session dataframes in array
-    session_dfs = []
-
-    # Get all date folders
-    folders = get_folder_paths(data_folder)
-
-    # Go through every folder in folders
-    for folder in folders:
+def combine_raw_session_dfs(
+    data_folder="../data/sessions/Sensirion", output_name=False, use_cache=True, workers=1, calibration=None
+):
+    """Combines all raw station records into one dataframe and returns it.
 
-        # Get session files in folder
-        session_files = [f for f in os.listdir(folder) if f.lower().endswith(".csv")]
+    Session files are parsed in a process pool when workers is not 1 (None uses all cores).
+    Sensor values are corrected with calibration (see calibration.py) when it is given.
+    """
 
-        # Some session files must be found to proceed
-        if len(session_files) <= 0:
-            continue
+    # Get session files in all date folders
+    session_files = []
 
-        # Go through every session file
-        for s_file in session_files:
-            # Load raw session dataframe
-            raw_df = pd.read_csv(f"{folder}/{s_file}", index_col=0)
+    for folder in get_folder_paths(data_folder):
+        session_files += [f"{folder}/{f}" for f in sorted(os.listdir(folder)) if f.lower().endswith(".csv")]
 
-            session_dfs.append(raw_df)
+    # Load raw session dataframes
+    load = partial(load_cached_file, kind="raw_session", loader=read_raw_session_file, use_cache=use_cache)
+    session_dfs = map_parallel(load, session_files, workers)
 
     # Combine into one big session df
     df = pd.concat(session_dfs)
@@ -123,8 +268,8 @@ def combine_raw_session_dfs(data_folder="../data/sessions/Sensirion", output_nam
     # df.drop("Unnamed: 0", axis=1, inplace=True)
     df.reset_index(drop=True, inplace=True)
 
-    # Convert timestamp string column into datetime
-    df["Timestamp"] = df["Timestamp"].apply(lambda x: datetime.strptime(x, "%Y-%m-%d %H:%M:%S"))
+    if calibration:
+        df = apply_calibration(df, calibration)
 
     if output_name:
         df.to_csv(output_name, index=False)
@@ -132,7 +277,9 @@ def combine_raw_session_dfs(data_folder="../data/sessions/Sensirion", output_nam
     return df
 
 
-def get_computed_sessions(data_folder="../data/sessions/Sensirion", disc=False, output_name=False):
+def get_computed_sessions(
+    data_folder="../data/sessions/Sensirion", disc=False, output_name=False, use_cache=True, workers=1, calibration=None
+):
     """
     Goes through all sessions and takes the median value for every station record.
 
@@ -144,97 +291,22 @@ def get_computed_sessions(data_folder="../data/sessions/Sensirion", disc=False,
     Sensors: all sensors involved
     Pm2.5: median
     Session id: same
-    """
-
-    # Save all sessions in array
-    sessions = []
 
-    # Get all date folders
-    folders = get_folder_paths(data_folder)
-
-    # Go through every folder in folders
-    for folder in folders:
+    Session files are processed in a process pool when workers is not 1 (None uses all cores).
+    Sensor values are corrected with calibration (see calibration.py) before taking medians when it is given.
+    """
 
-        # Get session files in folder
-        session_files = [f for f in os.listdir(folder) if f.endswith(".csv")]
+    # Get session files in all date folders
+    session_files = []
 
-        # Some session files must be found to proceed
-        if len(session_files) <= 0:
-            continue
+    for folder in get_folder_paths(data_folder):
+        session_files += [f"{folder}/{f}" for f in sorted(os.listdir(folder)) if f.endswith(".csv")]
 
-        # Go through every session file
-        for s_file in session_files:
-            # Load session
-            raw_session_df = pd.read_csv(folder + "/" + s_file)
-            rows = []
-
-            # Get session id
-            session_id = raw_session_df.iloc[0]["Session Id"]
-
-            # Get all station names
-            stations = raw_session_df["Station"].unique()
-
-            # Go through all stations
-            for station in stations:
-                # Get all rows corresponding to the station
-                station_df = raw_session_df[raw_session_df["Station"] == station]
-
-                # Get median timestamp
-                timestamp = get_middle_value(station_df, "Timestamp")
-
-                # Split station_df into different sensors
-                sensors = sorted(list(station_df["Sensor"].unique()))
-
-                if disc:
-                    number_counts = np.array([])
-                else:
-                    # Save median PM2_5
-                    pm2_5s = np.array([])
-                    nc2_5s = np.array([])
-
-                for sensor in sensors:
-                    # Pick out sensor df
-                    sensor_df = station_df[station_df["Sensor"] == sensor]
-
-                    if disc:
-                        # Get median for sensor
-                        number_counts = np.append(number_counts, get_middle_value(sensor_df, "Number"))
-                    else:
-                        # Get median for sensor
-                        pm2_5s = np.append(pm2_5s, get_middle_value(sensor_df, "PM2.5"))
-                        nc2_5s = np.append(nc2_5s, get_middle_value(sensor_df, "NC2.5"))
-
-                if disc:
-                    NUMBER_COUNT = np.mean(number_counts)
-                else:
-                    # Take mean of all PM values
-                    PM2_5 = np.mean(pm2_5s)
-                    NC2_5 = np.mean(nc2_5s)
-
-                # Combine sensors into single label
-                sensors_label = "".join([str(s) for s in sensors])
-
-                # Create row
-                date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
-                time = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").time()
-
-                if disc:
-                    rows.append([session_id, timestamp, date, time, station, NUMBER_COUNT, sensors_label])
-                else:
-                    rows.append([session_id, timestamp, date, time, station, PM2_5, NC2_5, sensors_label])
-
-            # Combine all stations into one "averaged" session dataframe
-            if disc:
-                session_df = pd.DataFrame(
-                    rows, columns=["Session Id", "Timestamp", "Date", "Time", "Station", "Number", "Sensors"]
-                )
-            else:
-                session_df = pd.DataFrame(
-                    rows, columns=["Session Id", "Timestamp", "Date", "Time", "Station", "PM2.5", "NC2.5", "Sensors"]
-                )
-
-            # Add to all sessions
-            sessions.append(session_df)
+    # Compute station records for every session
+    kind = "computed_disc" if disc else "computed"
+    args = (disc, calibration) if calibration else (disc,)
+    load = partial(load_cached_file, kind=kind, loader=compute_session_file, args=args, use_cache=use_cache)
+    sessions = map_parallel(load, session_files, workers)
 
     # Combine sessions into one dataframe
     sessions_df = pd.concat(sessions)
@@ -250,7 +322,22 @@ def get_computed_sessions(data_folder="../data/sessions/Sensirion", disc=False,
         return sessions_df
 
 
-def get_calibrate_df(date, folder):
+def get_calibrate_df(date, folder, use_cache=True, head=150, tail=30, calibration=None, offsets=None):
+    """Combines the records of all sensors in a calibration folder.
+
+    Args:
+        date (str): Measurement date in format Y-m-d.
+        folder (str): Calibration folder, e.g. "../data/calibration_A".
+        use_cache (bool, optional): Set to False to bypass the frame cache. Defaults to True.
+        head (int, optional): Rows removed from the start of every file, while the sensors warm up. Defaults to 150.
+        tail (int, optional): Rows removed from the end of every file. Defaults to 30.
+        calibration (dict, optional): Corrections to apply, see calibration.py. Defaults to None.
+        offsets (dict, optional): Seconds added to the timestamps of a file, by file name (see alignment.py).
+            Defaults to None.
+
+    Returns:
+        dataframe: Records of all sensors with a Sensor column.
+    """
     # Store all raw dataframes in array
     calibrate_dfs = []
 
@@ -261,13 +348,20 @@ def get_calibrate_df(date, folder):
     for i, file_name in enumerate(sensirion_files):
 
         # Read individual sensor data
-        raw_df = pd.read_csv(folder + "/" + file_name, skiprows=1)
+        filepath = folder + "/" + file_name
+        raw_df = load_cached(
+            "sensor", [filepath], read_sensor_file, filepath, date, SENSOR_TIME_OFFSET, use_cache=use_cache
+        )
         raw_df["Sensor"] = str(file_name[0])
-        raw_df["Timestamp"] = raw_df["Time"].apply(lambda x: format_time(date, x) + timedelta(hours=2))
 
-        # Remove first 150 rows and last 30 rows
-        raw_df = raw_df[150:]
-        raw_df = raw_df[:-30]
+        # Keep the original column order, with Timestamp after Sensor
+        raw_df["Timestamp"] = raw_df.pop("Timestamp")
+
+        if offsets and file_name in offsets:
+            raw_df["Timestamp"] += pd.to_timedelta(offsets[file_name], unit="s")
+
+        # Remove first head rows and last tail rows
+        raw_df = raw_df.iloc[head : max(len(raw_df) - tail, head)]
 
         # Add to list
         calibrate_dfs.append(raw_df)
@@ -276,84 +370,204 @@ def get_calibrate_df(date, folder):
     calibrate_df = pd.concat(calibrate_dfs)
     calibrate_df.reset_index(drop=True, inplace=True)
 
+    if calibration:
+        calibrate_df = apply_calibration(calibrate_df, calibration)
+
     return calibrate_df
 
 
-def get_total_measurement_time(data_folder="../data/sensor_data", output_name=False):
-    """Computes the total measurement time for each sensor.
+def get_calibration_dfs(folders=None, use_cache=True, head=150, tail=30):
+    """Returns get_calibrate_df for every calibration folder, by folder.
 
     Args:
-        input_name (str, optional): [description]. Defaults to '../data/sensor_data'.
-        output_name (bool, optional): [description]. Defaults to False.
+        folders (dict, optional): Measurement date by calibration folder. Defaults to calibration.CALIBRATION_FOLDERS.
+        use_cache, head, tail: See get_calibrate_df.
+
+    Returns:
+        dict: Calibration records by folder, to be passed to calibration.fit_calibration.
+    """
+    folders = folders or CALIBRATION_FOLDERS
+
+    return {folder: get_calibrate_df(date, folder, use_cache, head, tail) for folder, date in folders.items()}
+
+
+def count_sensor_records(folder):
+    """Returns the number of records for every sensor in a sensor data date folder, without loading the files."""
+    sensor_records = {}
+
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.lower().endswith(".csv"):
+            continue
+
+        sensor = file_name[0]
+        sensor_records[sensor] = sensor_records.get(sensor, 0) + count_csv_records(f"{folder}/{file_name}")
+
+    return sensor_records
+
+
+def get_measurement_reports(data_folder="../data/sensor_data", sensor_output=False, researcher_output=False, workers=1):
+    """Computes the measurement time per sensor and per date from a single scan of the sensor data.
+
+    Rows are counted by streaming through the files instead of loading them, and every record is one second.
+
+    Args:
+        data_folder (str, optional): Folder with one sub-folder per date. Defaults to '../data/sensor_data'.
+        sensor_output (str, optional): File to save the time per sensor to. Defaults to False.
+        researcher_output (str, optional): File to save the time per date to. Defaults to False.
+        workers (int, optional): Number of processes scanning date folders, None uses all cores. Defaults to 1.
+
+    Returns:
+        (dataframe, dataframe): Seconds per sensor and seconds the researchers were measuring per date.
     """
 
-    # Get all measurement times for the different sensors
+    # Get all measurement times for the different sensors and dates
     sensor_times = {}
+    date_times = {}
 
     # Get all date folders
     folders = get_folder_paths(data_folder)
 
-    # Go through every folder and get sensor dfs
-    for folder in folders:
+    # Count sensor records in every folder
+    for folder, sensor_records in zip(folders, map_parallel(count_sensor_records, folders, workers)):
         date = folder[-10:]
-        s_dfs, labels, data_files = get_sensor_dfs(date, sensors=[], period="", use_all=True)
 
-        s_df = pd.concat(s_dfs)
-        for sensor, grp in s_df.groupby("Sensor"):
-            if sensor not in sensor_times:
-                # Initialize to zero seconds
-                sensor_times[sensor] = 0
+        for sensor, records in sensor_records.items():
+            # Add number of rows to the sensor total
+            sensor_times[sensor] = sensor_times.get(sensor, 0) + records
+
+            # The researchers measured for as long as the longest running sensor
+            date_times[date] = max(date_times.get(date, 0), records)
 
-            # Get number of rows and add
-            sensor_times[sensor] += len(grp)
+    # Turn into pandas dataframes
+    sensor_df = pd.DataFrame(sensor_times.items(), columns=["Sensor", "Seconds"])
+    sensor_df["Sensor"] = sensor_df["Sensor"].astype(str)
 
-    # Turn into pandas dataframe
-    measurement_df = pd.DataFrame(sensor_times.items(), columns=["Sensor", "Seconds"])
-    measurement_df["Sensor"] = measurement_df["Sensor"].astype(str)
+    researcher_df = pd.DataFrame(date_times.items(), columns=["Date", "Seconds"])
 
     # Save to
-    if output_name:
-        measurement_df.to_csv(output_name, index=False)
-    else:
+    if sensor_output:
+        sensor_df.to_csv(sensor_output, index=False)
+
+    if researcher_output:
+        researcher_df.to_csv(researcher_output, index=False)
+
+    return sensor_df, researcher_df
+
+
+def get_total_measurement_time(data_folder="../data/sensor_data", output_name=False, workers=1):
+    """Computes the total measurement time for each sensor.
+
+    Args:
+        input_name (str, optional): [description]. Defaults to '../data/sensor_data'.
+        output_name (bool, optional): [description]. Defaults to False.
+        workers (int, optional): Number of processes scanning date folders, None uses all cores. Defaults to 1.
+    """
+    measurement_df, _ = get_measurement_reports(data_folder, sensor_output=output_name, workers=workers)
+
+    if not output_name:
         return measurement_df
 
 
-def get_measuring_time(data_folder="../data/sensor_data", output_name=False):
+def get_measuring_time(data_folder="../data/sensor_data", output_name=False, workers=1):
     """Computes the measurement time THE RESEARCHERS were on the platform.
 
     Args:
         input_name (str, optional): [description]. Defaults to '../data/sensor_data'.
         output_name (bool, optional): [description]. Defaults to False.
+        workers (int, optional): Number of processes scanning date folders, None uses all cores. Defaults to 1.
     """
+    _, measurement_df = get_measurement_reports(data_folder, researcher_output=output_name, workers=workers)
 
-    # Get all measurement times for the different sensors
-    date_times = {}
+    if not output_name:
+        return measurement_df
 
-    # Get all date folders
-    folders = get_folder_paths(data_folder)
 
-    # Go through every folder and get sensor dfs
-    for folder in folders:
-        date = folder[-10:]
-        s_dfs, labels, data_files = get_sensor_dfs(date, sensors=[], period="", use_all=True)
+################################
+# SESSION EXTRACTION
+################################
 
-        s_df = pd.concat(s_dfs)
-        for sensor, grp in s_df.groupby("Sensor"):
-            if date not in date_times:
-                # Initialize to zero seconds
-                date_times[date] = 0
 
-            # Get number of rows and add
-            sensor_records = len(grp)
+def get_placetimes(filepath="../data/sessions/placetimes.csv", missing_stop="drop"):
+    """Loads the station windows and converts start and stop into timestamps.
 
-            if sensor_records > date_times[date]:
-                date_times[date] = sensor_records
+    Args:
+        filepath (str, optional): Path to placetimes file. Defaults to '../data/sessions/placetimes.csv'.
+        missing_stop (str, optional): What to do with windows without a stop time. "drop" removes them,
+            "next" stops them at the start of the next window on the same date and period. Defaults to "drop".
 
-    # Turn into pandas dataframe
-    measurement_df = pd.DataFrame(date_times.items(), columns=["Date", "Seconds"])
+    Returns:
+        dataframe: Windows with date, period, station, start and stop columns, sorted by start.
+    """
+    if missing_stop not in ["drop", "next"]:
+        raise ValueError(f"Unknown missing_stop: {missing_stop}")
 
-    # Save to
-    if output_name:
-        measurement_df.to_csv(output_name, index=False)
-    else:
-        return measurement_df
+    windows = pd.read_csv(filepath)
+
+    # Windows without a start can not be placed in time
+    windows = windows.dropna(subset=["start"])
+
+    windows["start"] = pd.to_datetime(windows["date"] + " " + windows["start"], format="%Y-%m-%d %H:%M:%S")
+    windows["stop"] = pd.to_datetime(windows["date"] + " " + windows["stop"], format="%Y-%m-%d %H:%M:%S")
+
+    windows = windows.sort_values("start").reset_index(drop=True)
+
+    if missing_stop == "next":
+        next_start = windows.groupby(["date", "period"])["start"].shift(-1)
+        windows["stop"] = windows["stop"].fillna(next_start)
+
+    # Drop windows that are still open
+    windows = windows.dropna(subset=["stop"]).reset_index(drop=True)
+
+    return windows
+
+
+def extract_station_records(stream_df, windows):
+    """Cuts the records inside every station window out of continuous sensor streams.
+
+    Every sensor stream is sorted by timestamp once, and all windows are resolved with
+    np.searchsorted, so the cost grows with the number of extracted records instead of
+    windows times stream length. Both start and stop are inclusive.
+
+    Args:
+        stream_df (dataframe): Sensor records with Timestamp and Sensor columns, e.g. from get_sensor_dfs or get_disc_df.
+        windows (dataframe): Windows with station, start and stop columns, e.g. from get_placetimes.
+            A "Session Id" column is copied to the records when present.
+
+    Returns:
+        dataframe: Records inside the windows with added Station and Date columns, per sensor in window order.
+    """
+    starts = windows["start"].to_numpy(dtype="datetime64[ns]")
+    stops = windows["stop"].to_numpy(dtype="datetime64[ns]")
+
+    labels = pd.DataFrame({"Station": windows["station"].to_numpy(), "Date": windows["start"].dt.strftime("%Y-%m-%d")})
+    if "Session Id" in windows:
+        labels["Session Id"] = windows["Session Id"].to_numpy()
+
+    all_timestamps = stream_df["Timestamp"].to_numpy(dtype="datetime64[ns]")
+    chunks = []
+
+    for sensor, indices in stream_df.groupby("Sensor").indices.items():
+        # Sort sensor stream by time
+        order = indices[np.argsort(all_timestamps[indices], kind="stable")]
+        timestamps = all_timestamps[order]
+
+        # Find first and last record of every window
+        left = np.searchsorted(timestamps, starts, side="left")
+        right = np.maximum(np.searchsorted(timestamps, stops, side="right"), left)
+        counts = right - left
+
+        # Expand the windows into record positions
+        window_ids = np.repeat(np.arange(len(windows)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = order[left[window_ids] + offsets]
+
+        chunk = stream_df.iloc[positions].reset_index(drop=True)
+        for column in labels:
+            chunk[column] = labels[column].to_numpy()[window_ids]
+
+        chunks.append(chunk)
+
+    if not chunks:
+        return stream_df.iloc[:0].assign(**{column: [] for column in labels})
+
+    return pd.concat(chunks, ignore_index=True)
@@ -14,6 +14,54 @@ import sys
 
 from src.util import *
 from src.frames import *
+from src.calibration import apply_calibration
+
+################################
+# MERGE FUNCTIONS
+################################
+
+
+def merge_station_records(r_df, time_column="Time"):
+    """Merges raw records into one record per session and station.
+
+    Every data column is averaged per (Session Id, Station), the timestamp is the middle
+    timestamp of the station records and Sensors lists the sensors used in the session.
+    All sessions are handled by grouped operations over the whole table.
+
+    Args:
+        r_df (dataframe): Raw session records with Session Id, Station, Sensor and Timestamp columns.
+        time_column (str, optional): Name of the clock time column to add. Defaults to "Time".
+
+    Returns:
+        dataframe: One row per session and station, ordered by Session Id and Station.
+    """
+    keys = ["Session Id", "Station"]
+
+    # Get the mean of all data columns
+    data_columns = [c for c in r_df.select_dtypes("number").columns if c not in keys + ["Sensor"]]
+    sessions_df = r_df.groupby(keys)[data_columns].mean().reset_index()
+
+    # Combine the sensors of every session into a single label, in order of appearance
+    sensors = r_df[["Session Id", "Sensor"]].drop_duplicates()
+    sensors_label = sensors["Sensor"].astype(str).groupby(sensors["Session Id"]).agg("".join)
+    sessions_df["Sensors"] = sessions_df["Session Id"].map(sensors_label)
+
+    # Get the middle timestamp of every station
+    timestamps = r_df[keys].copy()
+    timestamps["Timestamp"] = r_df["Timestamp"].astype(str).str[:19]
+    sessions_df["Timestamp"] = get_middle_values(timestamps, keys, "Timestamp").to_numpy()
+
+    # Add time data
+    sessions_df["Date"] = sessions_df["Timestamp"].str[:10]
+    sessions_df[time_column] = sessions_df["Timestamp"].str[-8:]
+    sessions_df["Timestamp"] = pd.to_datetime(sessions_df["Timestamp"], format="%Y-%m-%d %H:%M:%S")
+
+    # Add period label
+    clock = sessions_df[time_column]
+    sessions_df["Period"] = np.select([morning(clock), evening(clock)], ["Morning rush", "Evening rush"], "Offtime")
+
+    return sessions_df
+
 
 ################################
 # MAIN
@@ -21,12 +69,17 @@ from src.frames import *
 
 
 def merge_sensirion_sensors(
-    input_file="../results/sessions/sensirion_raw.csv", output_file="../results/sessions/sensirion.csv"
+    input_file="../results/sessions/sensirion_raw.csv",
+    output_file="../results/sessions/sensirion.csv",
+    calibration=None,
 ):
-    """Merges raw sensor values for each sensor."""
+    """Merges raw sensor values for each sensor, corrected with calibration (see calibration.py) when it is given."""
 
     r_df = pd.read_csv(input_file)
 
+    if calibration:
+        r_df = apply_calibration(r_df, calibration)
+
     column_order = [
         "Session Id",
         "Timestamp",
@@ -48,53 +101,8 @@ def merge_sensirion_sensors(
         "Time",
     ]
 
-    sessions = []
-
-    for session_id, session in r_df.groupby("Session Id"):
-        # Get the mean of all data columns
-        mean_df = session.groupby(["Station"]).mean()
-
-        # Add meta data to dataframe
-        mean_df["Sensors"] = "".join(list(session["Sensor"].unique()))
-        mean_df["Session Id"] = session_id
-        mean_df["Station"] = mean_df.index
-
-        # Reset index from stations to numbers
-        mean_df = mean_df.reset_index(drop=True)
-
-        # Go through every station and add timedata
-        station_times = {}
-
-        for station, grp in session.groupby("Station"):
-
-            # Get time data
-            timestamp = get_middle_value(grp, "Timestamp")
-            date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
-            time = timestamp[-8:]
-
-            station_times[station] = {"Timestamp": timestamp, "Date": date, "Time": time}
-
-        # Add time data to dataframe
-        tf = pd.DataFrame.from_dict(station_times).T
-        tf["Station"] = tf.index
-        tf = tf.reset_index(drop=True)
-
-        mean_df = pd.merge(mean_df, tf, on=["Station"])
-
-        # Add session to total session
-        sessions.append(mean_df)
-
-    # Combine sessions into one dataframe
-    sessions_df = pd.concat(sessions)
-    sessions_df.reset_index(drop=True, inplace=True)
-
-    # Convert timestamp string column into datetime
-    sessions_df["Timestamp"] = sessions_df["Timestamp"].apply(lambda x: datetime.strptime(x, "%Y-%m-%d %H:%M:%S"))
-
-    # Add period label
-    sessions_df["Period"] = sessions_df["Time"].apply(
-        lambda x: "Morning rush" if morning(x) else "Evening rush" if evening(x) else "Offtime"
-    )
+    # Merge records per session and station
+    sessions_df = merge_station_records(r_df, "Time")
 
     # Reorder columns
     sessions_df = sessions_df[column_order]
@@ -126,64 +134,12 @@ def merge_disc_sensor(input_file="../results/sessions/disc_raw.csv", output_file
         "Time",
     ]
 
-    sessions = []
-
-    for session_id, session in r_df.groupby("Session Id"):
-        # Convert to int
-        session["Size"] = session["Size"].apply(lambda x: float(x.replace(",", ".")))
-        session["LDSA"] = session["LDSA"].apply(lambda x: float(x.replace(",", ".")))
-        session["Diff"] = session["Diff"].apply(lambda x: float(x.replace(",", ".")))
-        session["Filter"] = session["Filter"].apply(lambda x: float(x.replace(",", ".")))
-        # session[["Number", "Size", "LDSA", "Diff", "Filter"]] = session[["Number", "Size", "LDSA", "Diff", "Filter"]].apply(pd.to_numeric)
-
-        # Get the mean of all data columns
-        mean_df = session.groupby(["Station"]).mean()
-
-        # Add meta data to dataframe
-        mean_df["Sensors"] = "".join(list(session["Sensor"].unique()))
-        mean_df["Session Id"] = session_id
-        mean_df["Station"] = mean_df.index
-
-        # Reset index from stations to numbers
-        mean_df = mean_df.reset_index(drop=True)
+    # Convert decimal commas to floats for all sessions at once
+    for column in ["Size", "LDSA", "Diff", "Filter"]:
+        r_df[column] = r_df[column].astype(str).str.replace(",", ".", regex=False).astype(float)
 
-        # Go through every station and add timedata
-        station_times = {}
-
-        for station, grp in session.groupby("Station"):
-
-            # Get time data
-            timestamp = get_middle_value(grp, "Timestamp")
-
-            if type(timestamp) != str:
-                timestamp = str(timestamp)
-
-            date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
-            time = timestamp[-8:]
-
-            station_times[station] = {"Timestamp": timestamp, "Date": date, "Clock Time": time}
-
-        # Add time data to dataframe
-        tf = pd.DataFrame.from_dict(station_times).T
-        tf["Station"] = tf.index
-        tf = tf.reset_index(drop=True)
-
-        mean_df = pd.merge(mean_df, tf, on=["Station"])
-
-        # Add session to total session
-        sessions.append(mean_df)
-
-    # Combine sessions into one dataframe
-    sessions_df = pd.concat(sessions)
-    sessions_df.reset_index(drop=True, inplace=True)
-
-    # Convert timestamp string column into datetime
-    sessions_df["Timestamp"] = sessions_df["Timestamp"].apply(lambda x: datetime.strptime(x, "%Y-%m-%d %H:%M:%S"))
-
-    # Add period label
-    sessions_df["Period"] = sessions_df["Clock Time"].apply(
-        lambda x: "Morning rush" if morning(x) else "Evening rush" if evening(x) else "Offtime"
-    )
+    # Merge records per session and station
+    sessions_df = merge_station_records(r_df, "Clock Time")
 
     # Reorder columns
     sessions_df = sessions_df[column_order]
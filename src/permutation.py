@@ -0,0 +1,189 @@
+"""
+permutation.py
+
+Permutation tests for Stockholm Air Pollution project.
+
+Permutations are drawn as batches of index rows into the pooled values, and the test
+statistic is computed for a whole batch with one NumPy operation. Batches can be spread
+over a process pool for large numbers of permutations.
+"""
+
+################################
+# LIBRARIES
+################################
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+
+from src.util import map_parallel, get_inside_stations, get_outside_stations
+
+# Result of a permutation test
+PermutationResult = namedtuple("PermutationResult", ["statistic", "p_value", "n_permutations", "null_distribution"])
+
+# Statistics that permutation_test can compute
+STATISTICS = ["mean", "median", "ratio"]
+
+# Permutations drawn from one seed; blocks are the units handed out to worker processes
+PERMUTATION_BLOCK = 2000
+
+################################
+# STATISTICS
+################################
+
+
+def group_statistic(samples, sizes, statistic="mean"):
+    """Computes the test statistic for every row of pooled samples.
+
+    Every row holds the values of all groups one after the other, with group i taking the
+    next sizes[i] values. For two groups the statistic is the difference of means or medians
+    of the first and second group, or the ratio of their means. For more groups it is the
+    size weighted sum of squared deviations of the group means or medians from the pooled
+    mean or median (the between group sum of squares for means).
+
+    Args:
+        samples (array): 2D array with one pooled sample per row.
+        sizes (list): Number of values in every group.
+        statistic (str, optional): "mean", "median" or "ratio". Defaults to "mean".
+
+    Returns:
+        array: The statistic of every row.
+    """
+    bounds = np.cumsum([0] + list(sizes))
+    groups = [samples[:, start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    if statistic == "ratio":
+        if len(groups) != 2:
+            raise ValueError("The ratio statistic compares exactly two groups")
+        return groups[0].mean(axis=1) / groups[1].mean(axis=1)
+
+    reduce = np.mean if statistic == "mean" else np.median
+    centres = np.stack([reduce(group, axis=1) for group in groups])
+
+    if len(groups) == 2:
+        return centres[0] - centres[1]
+
+    pooled = reduce(samples, axis=1)
+
+    return np.sum(np.asarray(sizes)[:, np.newaxis] * (centres - pooled) ** 2, axis=0)
+
+
+def permuted_statistics(item, pooled, sizes, statistic="mean", max_cells=10**7):
+    """Computes the statistic for a number of random permutations of the pooled values.
+
+    Args:
+        item (tuple): Number of permutations and a np.random.SeedSequence for the generator.
+        pooled (array): Values of all groups, one group after the other.
+        sizes (list): Number of values in every group.
+        statistic (str, optional): See group_statistic. Defaults to "mean".
+        max_cells (int, optional): Largest index array drawn at once. Defaults to 10**7.
+
+    Returns:
+        array: The statistic of every permutation.
+    """
+    n_permutations, seed = item
+    rng = np.random.default_rng(seed)
+    n = len(pooled)
+    batch = max(1, max_cells // n)
+
+    results = []
+    for start in range(0, n_permutations, batch):
+        rows = min(batch, n_permutations - start)
+        indices = rng.permuted(np.broadcast_to(np.arange(n), (rows, n)), axis=1)
+        results.append(group_statistic(pooled[indices], sizes, statistic))
+
+    return np.concatenate(results) if results else np.empty(0)
+
+
+################################
+# TESTS
+################################
+
+
+def permutation_test(
+    samples,
+    statistic="mean",
+    n_permutations=10000,
+    alternative="two-sided",
+    seed=None,
+    workers=1,
+    block_size=PERMUTATION_BLOCK,
+):
+    """Performs a permutation test on two or more samples.
+
+    Args:
+        samples (list): Arrays of values, one per group.
+        statistic (str, optional): "mean", "median" or "ratio", see group_statistic. Defaults to "mean".
+        n_permutations (int, optional): Number of random permutations. Defaults to 10000.
+        alternative (str, optional): "two-sided", "greater" or "less". Tests of more than two
+            groups are always one-sided ("greater"). Defaults to "two-sided".
+        seed (int, optional): Seed for the random generators. Defaults to None.
+        workers (int, optional): Number of worker processes, see util.map_parallel. Defaults to 1.
+        block_size (int, optional): Permutations per block. Every block has its own generator
+            spawned from seed, so the result for a seed does not depend on workers. Defaults to
+            PERMUTATION_BLOCK.
+
+    Returns:
+        PermutationResult: Observed statistic, p-value, number of permutations and the
+        statistic of every permutation.
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic {statistic}, use one of {STATISTICS}")
+    if alternative not in ("two-sided", "greater", "less"):
+        raise ValueError(f"Unknown alternative {alternative}, use 'two-sided', 'greater' or 'less'")
+
+    samples = [np.asarray(sample, dtype=float) for sample in samples]
+    samples = [sample[~np.isnan(sample)] for sample in samples]
+    sizes = [len(sample) for sample in samples]
+    pooled = np.concatenate(samples)
+
+    observed = group_statistic(pooled[np.newaxis], sizes, statistic)[0]
+
+    # Split the permutations into fixed-size blocks with their own generators
+    starts = range(0, n_permutations, block_size)
+    counts = [min(block_size, n_permutations - start) for start in starts]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+
+    function = partial(permuted_statistics, pooled=pooled, sizes=sizes, statistic=statistic)
+    null_distribution = np.concatenate(map_parallel(function, list(zip(counts, seeds)), workers))
+
+    # Compare on a log scale for ratios, so that a ratio and its inverse are equally extreme
+    centre = 1.0 if statistic == "ratio" else 0.0
+    if len(samples) > 2:
+        alternative = "greater"
+
+    if alternative == "two-sided":
+        scale = np.log if statistic == "ratio" else (lambda x: x)
+        extreme = np.abs(scale(null_distribution) - scale(centre)) >= np.abs(scale(observed) - scale(centre))
+    elif alternative == "greater":
+        extreme = null_distribution >= observed
+    else:
+        extreme = null_distribution <= observed
+
+    # Include the observed arrangement so that the p-value is never 0
+    p_value = (np.sum(extreme) + 1) / (n_permutations + 1)
+
+    return PermutationResult(observed, p_value, n_permutations, null_distribution)
+
+
+def compare_stations(df, column, partition=None, by="Station", **kwargs):
+    """Performs a permutation test between groups of stations.
+
+    Args:
+        df (dataframe): Records with a station column, e.g. computed sessions.
+        column (str): Column to compare, e.g. "PM2.5".
+        partition (dict, optional): Lists of stations by group name. Defaults to the inside
+            and outside stations from util.
+        by (str, optional): Column with the station names. Defaults to "Station".
+        **kwargs: Arguments passed on to permutation_test.
+
+    Returns:
+        PermutationResult: See permutation_test. For two groups the statistic compares the
+        first group of the partition with the second.
+    """
+    if partition is None:
+        partition = {"inside": get_inside_stations(), "outside": get_outside_stations()}
+
+    samples = [df.loc[df[by].isin(stations), column].to_numpy(dtype=float) for stations in partition.values()]
+
+    return permutation_test(samples, **kwargs)
@@ -1,13 +1,30 @@
 ################################
 # LIBRARIES
 ################################
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
 from math import ceil, dist, floor
+import hashlib
+import inspect
+import json
+import os
+import time
 import matplotlib.pyplot as plt
 from numpy import float_power
+import numpy as np
+import pandas as pd
 import seaborn as sns
 import scipy.stats as stats
+from scipy import fft
 
 from matplotlib import dates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+
+from src.stats import describe_groups
+from src.util import map_parallel
 
 # Matplotlib settings
 plt.style.use("seaborn")
@@ -30,18 +47,307 @@ plt.close("all")
 # Apply the default theme
 sns.set_theme()
 
+# Points of the KDE line drawn over every histogram, as in seaborn
+KDE_GRIDSIZE = 200
+
+# Resolution figures are saved with
+SAVE_DPI = 300
+
+# Size of a time series PDF without lines, per drawn trace and per plotted point, used to turn a file
+# size cap into a point cap. Measured sizes are about 11000, 330 and 10 bytes; the values leave headroom.
+PDF_BASE_BYTES = 12000
+PDF_BYTES_PER_TRACE = 500
+PDF_BYTES_PER_POINT = 12
+
+# Downsampling method used when a point or file size cap is given without a method
+DEFAULT_DOWNSAMPLER = "minmax"
+
+# Set while batch rendering: figures are then drawn on their own Agg canvas instead of through pyplot
+HEADLESS = {"active": False}
+
+
+@contextmanager
+def headless_figures():
+    """Creates the figures of the plot functions on Agg canvases outside pyplot while active.
+
+    The pyplot backend and the figures that are already open, e.g. in a notebook, are not touched.
+    """
+    active = HEADLESS["active"]
+    HEADLESS["active"] = True
+
+    try:
+        yield
+    finally:
+        HEADLESS["active"] = active
+
+
+def subplots(nrows=1, ncols=1, figsize=None, dpi=None, **kwargs):
+    """Like plt.subplots, but creates a figure with its own Agg canvas inside headless_figures."""
+    if not HEADLESS["active"]:
+        return plt.subplots(nrows=nrows, ncols=ncols, figsize=figsize, dpi=dpi, **kwargs)
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+
+    return fig, fig.subplots(nrows=nrows, ncols=ncols, **kwargs)
+
+
+################################
+# DOWNSAMPLING
+################################
+
+
+def time_buckets(x, n_buckets):
+    """Returns the bucket of every value of x when the range of x is split into n_buckets equal parts."""
+    x = np.asarray(x, dtype=float)
+    span = x[-1] - x[0]
+
+    if span <= 0:
+        return np.zeros(len(x), dtype=int)
+
+    return np.minimum(((x - x[0]) / span * n_buckets).astype(int), n_buckets - 1)
+
+
+def bucket_argmax(buckets, values):
+    """Returns the position of the largest value in every bucket, ordered by bucket."""
+    order = np.lexsort((-values, buckets))
+    first = np.r_[True, buckets[order][1:] != buckets[order][:-1]]
+    return order[first]
+
+
+def minmax_indices(x, y, n_out):
+    """Min/max envelope decimation.
+
+    The time range is split into n_out / 2 equal buckets and the lowest and highest reading of
+    every bucket is kept, so every peak survives.
+
+    Args:
+        x (array): Sorted time values as numbers, e.g. nanoseconds.
+        y (array): Values without missing values.
+        n_out (int): Largest number of points to keep.
+
+    Returns:
+        array: Sorted positions of the kept points.
+    """
+    buckets = time_buckets(x, max(n_out // 2 - 1, 1))
+    y = np.asarray(y, dtype=float)
+    keep = np.concatenate([[0, len(y) - 1], bucket_argmax(buckets, y), bucket_argmax(buckets, -y)])
+
+    return np.unique(keep)
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last point are kept and the points in between are split into n_out - 2 equal
+    time buckets. Every bucket keeps the point that spans the largest triangle with the point
+    kept in the previous bucket and the mean of the next bucket. Classic LTTB walks the buckets
+    one after the other; here all buckets are computed at once in two passes, the first with the
+    mean of the previous bucket as anchor and the second with the points kept by the first pass.
+
+    Args:
+        x (array): Sorted time values as numbers, e.g. nanoseconds.
+        y (array): Values without missing values.
+        n_out (int): Number of points to keep, at least 3.
+
+    Returns:
+        array: Sorted positions of the kept points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x = x - x[0]
+
+    inner = np.arange(1, len(x) - 1)
+    buckets = time_buckets(x[inner], n_out - 2)
+    buckets = np.unique(buckets, return_inverse=True)[1]
+    n_buckets = buckets.max() + 1
+
+    # Mean of every bucket, with the first and last point as outer neighbours
+    counts = np.bincount(buckets, minlength=n_buckets)
+    mean_x = np.r_[x[0], np.bincount(buckets, weights=x[inner]) / counts, x[-1]]
+    mean_y = np.r_[y[0], np.bincount(buckets, weights=y[inner]) / counts, y[-1]]
+
+    anchor_x, anchor_y = mean_x[:-2], mean_y[:-2]
+    next_x, next_y = mean_x[2:], mean_y[2:]
+
+    for _ in range(2):
+        ax, ay = anchor_x[buckets], anchor_y[buckets]
+        area = np.abs((ax - next_x[buckets]) * (y[inner] - ay) - (ax - x[inner]) * (next_y[buckets] - ay))
+        selected = inner[bucket_argmax(buckets, area)]
+
+        anchor_x = np.r_[x[0], x[selected][:-1]]
+        anchor_y = np.r_[y[0], y[selected][:-1]]
+
+    return np.concatenate([[0], selected, [len(x) - 1]])
+
+
+# Downsampling methods of plot_sensors_over_time
+DOWNSAMPLERS = {"lttb": lttb_indices, "minmax": minmax_indices}
+
+
+def downsample_indices(x, y, n_out, method="lttb"):
+    """Returns the positions of the readings to plot when a trace is downsampled to about n_out points.
+
+    Args:
+        x (array): Sorted timestamps or numbers.
+        y (array): Values, missing values are dropped.
+        n_out (int): Number of points to keep.
+        method (str, optional): "lttb" or "minmax" (min/max envelope, keeps every peak). "lttb" is an
+            approximate Largest-Triangle-Three-Buckets computed for all buckets at once, which keeps
+            about 80% of the points of sequential LTTB (see lttb_indices). Defaults to "lttb".
+
+    Returns:
+        array: Sorted positions into x and y.
+    """
+    if method not in DOWNSAMPLERS:
+        raise ValueError(f"Unknown downsampling method {method}, use one of {list(DOWNSAMPLERS)}")
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").astype(np.int64)
+
+    valid = np.flatnonzero(~np.isnan(np.asarray(y, dtype=float)))
+    if len(valid) <= max(n_out, 3):
+        return valid
+
+    return valid[DOWNSAMPLERS[method](x[valid], np.asarray(y, dtype=float)[valid], max(n_out, 3))]
+
+
+################################
+# DISTRIBUTIONS
+################################
+
+# Histogram and KDE line of every group: describe_groups statistics, and per group the bin edges,
+# bin counts, KDE grid and KDE scaled to the counts
+GroupDistributions = namedtuple("GroupDistributions", ["stats", "edges", "counts", "grid", "kde"])
+
+
+def histogram_bin_counts(n, span, iqr, bins=False):
+    """Number of histogram bins of every group, like np.histogram_bin_edges with bins="auto"."""
+    if bins:
+        return np.full(len(n), int(bins))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sturges = span / (np.log2(n) + 1)
+        fd = 2 * iqr * n ** (-1 / 3)
+        width = np.where(fd > 0, np.minimum(fd, sturges), sturges)
+        n_bins = np.ceil(span / width)
+
+    return np.where(np.isfinite(n_bins) & (n_bins > 0), n_bins, 1).astype(int)
+
+
+def gaussian_smooth(grid_counts, sigma):
+    """Convolves every row of grid_counts with a Gaussian of sigma[row] grid steps using FFTs."""
+    size = grid_counts.shape[1]
+    padded = fft.next_fast_len(size + int(np.ceil(4 * min(np.max(sigma, initial=0), size))), real=True)
+
+    frequencies = fft.rfftfreq(padded)
+    kernels = np.exp(-0.5 * (2 * np.pi * frequencies * sigma[:, np.newaxis]) ** 2)
+
+    return fft.irfft(fft.rfft(grid_counts, padded, axis=1) * kernels, padded, axis=1)[:, :size]
+
+
+def group_distributions(df, by, param="PM2.5", bins=False, sort=False, gridsize=KDE_GRIDSIZE):
+    """Computes the histogram and Gaussian KDE of every group in one pass over the records.
+
+    The statistics come from stats.describe_groups. Histograms use the same bins as
+    seaborn.histplot. The KDE uses the Scott bandwidth of seaborn on the data range: the values
+    are linearly binned onto the KDE grid of their group and smoothed with FFTs, for all groups at
+    once. The KDE is scaled to the histogram counts, as drawn by histplot(kde=True).
+
+    Args:
+        df (dataframe): Records with a group column.
+        by (str): Column to group by, e.g. "Station" or "Sensor".
+        param (str, optional): Column with the values. Defaults to "PM2.5".
+        bins (int, optional): Number of histogram bins. Defaults to False (numpy "auto" rule per group).
+        sort (bool, optional): Set to True to order the groups by key instead of first appearance. Defaults to False.
+        gridsize (int, optional): Points of the KDE grid. Defaults to KDE_GRIDSIZE.
+
+    Returns:
+        GroupDistributions: Statistics indexed by group, and lists of edges, counts, grid and kde per group.
+    """
+    codes, keys = pd.factorize(df[by], sort=sort)
+    values = df[param].to_numpy(dtype=float)
+
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+
+    stats_df = describe_groups(df, by, param).reindex(keys)
+    n = stats_df["count"].to_numpy(dtype=float)
+    low = stats_df["min"].to_numpy()
+    span = stats_df["x_range"].to_numpy()
+
+    # A single distinct value gets a unit range around it, like numpy
+    low = np.where(span > 0, low, low - 0.5)
+    span = np.where(span > 0, span, 1.0)
+
+    # Histograms of all groups as rows of one padded array
+    n_bins = histogram_bin_counts(n, span, stats_df["IQR"].to_numpy(), bins)
+    width = span / n_bins
+    columns = n_bins.max(initial=1)
+
+    bin_index = np.clip(((values - low[codes]) / width[codes]).astype(int), 0, n_bins[codes] - 1)
+    counts = np.bincount(codes * columns + bin_index, minlength=len(keys) * columns).reshape(len(keys), columns)
+
+    # Linear binning onto the KDE grid of every group, followed by Gaussian smoothing
+    step = span / (gridsize - 1)
+    position = (values - low[codes]) / step[codes]
+    below = np.clip(np.floor(position).astype(int), 0, gridsize - 2)
+    fraction = position - below
+
+    cells = codes * gridsize + below
+    grid_counts = np.bincount(cells, weights=1 - fraction, minlength=len(keys) * gridsize)
+    grid_counts += np.bincount(cells + 1, weights=fraction, minlength=len(keys) * gridsize)
+    grid_counts = grid_counts.reshape(len(keys), gridsize)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bandwidth = stats_df["sample_std"].to_numpy() * n ** (-1 / 5)
+        sigma = np.where(bandwidth > 0, bandwidth / step, 0)
+        density = gaussian_smooth(grid_counts, sigma) / (n * step)[:, np.newaxis]
+        kde = np.where((bandwidth > 0)[:, np.newaxis], density * (n * width)[:, np.newaxis], np.nan)
+
+    offsets = np.arange(max(columns, gridsize) + 1)
+
+    return GroupDistributions(
+        stats_df,
+        [low[i] + width[i] * offsets[: n_bins[i] + 1] for i in range(len(keys))],
+        [counts[i, : n_bins[i]] for i in range(len(keys))],
+        [low[i] + step[i] * offsets[:gridsize] for i in range(len(keys))],
+        list(kde),
+    )
+
+
+def plot_group_distribution(ax, distributions, i, color):
+    """Draws the histogram and KDE line of group i of a GroupDistributions, in the style of seaborn.histplot."""
+    if not distributions.stats["count"].iloc[i]:
+        return
+
+    edges = distributions.edges[i]
+
+    ax.bar(
+        edges[:-1],
+        distributions.counts[i],
+        width=np.diff(edges),
+        align="edge",
+        facecolor=to_rgba(color, 0.5),
+        edgecolor=plt.rcParams["patch.edgecolor"],
+    )
+    ax.plot(distributions.grid[i], distributions.kde[i], color=color)
+
+
 ################################
 # GENERAL PLOTTING FUNCTIONS
 ################################
 
 
-def format_time_axis():
-    plt.gcf().autofmt_xdate()
+def format_time_axis(ax=None):
+    ax = ax or plt.gca()
+    ax.figure.autofmt_xdate()
     myFmt = dates.DateFormatter("%H:%M:%S")
-    plt.gca().xaxis.set_major_formatter(myFmt)
+    ax.xaxis.set_major_formatter(myFmt)
 
 
-def plot_sensor_distributions(s_df, title, fig_name=False, bins=False, param="PM2.5", with_textbox=False):
+def plot_sensor_distributions(s_df, title, fig_name=False, bins=False, param="PM2.5", with_textbox=False, show=True):
     def add_textbox(graph_text, ax):
         # Build a rectangle in axes coords
         left, width = 0.45, 0.5
@@ -65,22 +371,21 @@ def plot_sensor_distributions(s_df, title, fig_name=False, bins=False, param="PM
         )
         t.set_bbox(dict(facecolor="white", alpha=0.5, edgecolor="white"))
 
-    sensor_count = len(s_df["Sensor"].unique())
+    distributions = group_distributions(s_df, "Sensor", param, bins, sort=True)
+    sensor_count = len(distributions.stats)
 
-    fig, axs = plt.subplots(ncols=sensor_count, dpi=250, sharey=True, figsize=[20, 7])
+    fig, axs = subplots(ncols=sensor_count, dpi=250, sharey=True, figsize=[20, 7])
+    axs = np.atleast_1d(axs)
 
     i = 0
-    for label, grp in s_df.groupby(["Sensor"]):
-        mean = grp[param].mean()
-        median = grp[param].median()
-        std = grp[param].std()
-        s_skew = stats.skew(grp[param], bias=False)
-        s_kurt = stats.kurtosis(grp[param], bias=False)
-
-        if bins:
-            sns.histplot(grp, x=param, ax=axs[i], kde=True, color=sns.color_palette()[i], bins=bins)
-        else:
-            sns.histplot(grp, x=param, ax=axs[i], kde=True, color=sns.color_palette()[i])
+    for label, row in distributions.stats.iterrows():
+        mean = row["mean"]
+        median = row["median"]
+        std = row["sample_std"]
+        s_skew = row["skew"]
+        s_kurt = row["kurtosis"]
+
+        plot_group_distribution(axs[i], distributions, i, sns.color_palette()[i % len(sns.color_palette())])
 
         axs[i].tick_params(axis="x", labelsize=18)
         axs[i].tick_params(axis="y", labelsize=18)
@@ -107,30 +412,38 @@ def plot_sensor_distributions(s_df, title, fig_name=False, bins=False, param="PM
 
         i += 1
 
-    plt.tight_layout()
+    fig.tight_layout()
     fig.subplots_adjust(top=0.85)
     fig.suptitle(title, fontsize=30)
 
     if fig_name:
-        plt.savefig(fig_name, dpi=300, bbox_inches="tight")
+        fig.savefig(fig_name, dpi=SAVE_DPI, bbox_inches="tight")
 
-    plt.plot()
+    if show:
+        plt.show()
 
+    return fig
 
-def plot_QQ_plots(s_df, title, param="PM2.5", fig_name=False, col_count=3, row_count=2, label="Sensor", size=(10, 7)):
-    fig, axs = plt.subplots(ncols=col_count, nrows=row_count, figsize=size, dpi=200)
 
-    for item, ax in zip(s_df[label].unique(), axs.flatten()):
-        stats.probplot(s_df[s_df[label] == item][param], dist="norm", plot=ax)
+def plot_QQ_plots(
+    s_df, title, param="PM2.5", fig_name=False, col_count=3, row_count=2, label="Sensor", size=(10, 7), show=True
+):
+    fig, axs = subplots(ncols=col_count, nrows=row_count, figsize=size, dpi=200)
+
+    for (item, values), ax in zip(s_df.groupby(label, sort=False)[param], axs.flatten()):
+        stats.probplot(values, dist="norm", plot=ax)
         ax.set_title(f"{label} {item}", fontsize=14)
 
-    plt.suptitle(title, fontsize=16)
-    plt.tight_layout()
+    fig.suptitle(title, fontsize=16)
+    fig.tight_layout()
 
     if fig_name:
-        plt.savefig(fig_name, dpi=300, bbox_inches="tight")
+        fig.savefig(fig_name, dpi=SAVE_DPI, bbox_inches="tight")
+
+    if show:
+        plt.show()
 
-    plt.show()
+    return fig
 
 
 def plot_distributions(
@@ -144,6 +457,7 @@ def plot_distributions(
     column_count=3,
     share_x=False,
     share_y=False,
+    show=True,
 ):
     def add_textbox(graph_text, ax):
         # Build a rectangle in axes coords
@@ -168,31 +482,24 @@ def plot_distributions(
         )
         t.set_bbox(dict(facecolor="white", alpha=0.5, edgecolor="white"))
 
-    row_count = ceil(len(df[dist_col].unique()) / column_count)
-    fig, axs = plt.subplots(
-        ncols=column_count, nrows=row_count, dpi=250, sharey=share_y, sharex=share_x, figsize=[20, 22]
-    )
+    distributions = group_distributions(df, dist_col, param, bins)
+
+    row_count = ceil(len(distributions.stats) / column_count)
+    fig, axs = subplots(ncols=column_count, nrows=row_count, dpi=250, sharey=share_y, sharex=share_x, figsize=[20, 22])
 
     i = 0
-    for dist_item, ax in zip(df[dist_col].unique(), axs.flatten()):
+    for group, ((dist_item, row), ax) in enumerate(zip(distributions.stats.iterrows(), axs.flatten())):
 
         if i >= len(sns.color_palette()):
             i = 0
 
-        current_grp = df[df[dist_col] == dist_item][param]
+        mean = row["mean"]
+        median = row["median"]
+        std = row["sample_std"]
+        s_skew = row["skew"]
+        s_kurt = row["kurtosis"]
 
-        mean = current_grp.mean()
-        median = current_grp.median()
-        std = current_grp.std()
-        s_skew = stats.skew(current_grp, bias=False)
-        s_kurt = stats.kurtosis(current_grp, bias=False)
-
-        if bins:
-            sns.histplot(
-                df[df[dist_col] == dist_item], x=param, ax=ax, kde=True, color=sns.color_palette()[i], bins=bins
-            )
-        else:
-            sns.histplot(df[df[dist_col] == dist_item], x=param, ax=ax, kde=True, color=sns.color_palette()[i])
+        plot_group_distribution(ax, distributions, group, sns.color_palette()[i])
 
         ax.tick_params(axis="x", labelsize=18)
         ax.tick_params(axis="y", labelsize=18)
@@ -217,36 +524,287 @@ def plot_distributions(
 
         i += 1
 
-    plt.tight_layout(h_pad=3)
+    fig.tight_layout(h_pad=3)
     fig.subplots_adjust(top=0.90)
     fig.suptitle(title, fontsize=30)
 
     if fig_name:
-        plt.savefig(fig_name, dpi=300, bbox_inches="tight")
+        fig.savefig(fig_name, dpi=SAVE_DPI, bbox_inches="tight")
+
+    if show:
+        plt.show()
+
+    return fig
+
+
+def plot_sensors_over_time(
+    df,
+    title,
+    param="PM2.5",
+    size=[12, 5],
+    fig_name=False,
+    unit="",
+    show=True,
+    downsample=None,
+    points_per_pixel=1,
+    max_points=None,
+    max_bytes=None,
+):
+    """Plots the readings of every sensor over time.
+
+    Long recordings can be downsampled before drawing with downsample="lttb" or "minmax". Every
+    trace then gets points_per_pixel points per pixel of the saved figure width, lowered so that
+    all traces together stay below max_points, or below max_bytes of PDF size. "minmax" keeps the
+    lowest and highest reading of every bucket, so every peak is kept. "lttb" is an approximate
+    Largest-Triangle-Three-Buckets that handles all buckets at once; it keeps about 80% of the
+    points that sequential LTTB keeps, see lttb_indices. A cap without a method uses
+    DEFAULT_DOWNSAMPLER.
 
-    plt.plot()
+    The file size is estimated before drawing. When the saved file is still larger than
+    max_bytes, it is redrawn with fewer points until it fits.
+    """
+    if downsample is None and (max_points or max_bytes):
+        downsample = DEFAULT_DOWNSAMPLER
 
+    fig, ax = subplots(figsize=size, dpi=200)
 
-def plot_sensors_over_time(df, title, param="PM2.5", size=[12, 5], fig_name=False, unit=""):
-    fig, ax = plt.subplots(figsize=size, dpi=200)
+    groups = list(df.groupby("Sensor"))
 
-    for label, grp in df.groupby("Sensor"):
+    if downsample:
+        n_points = int(size[0] * SAVE_DPI * points_per_pixel)
+        if max_bytes:
+            budget = max_bytes - PDF_BASE_BYTES - PDF_BYTES_PER_TRACE * len(groups)
+            max_points = min(max_points or np.inf, max(budget, 0) // PDF_BYTES_PER_POINT)
+        if max_points:
+            n_points = max(3, min(n_points, int(max_points // max(len(groups), 1))))
+
+    def downsampled(timestamps, values):
+        keep = downsample_indices(timestamps.to_numpy(), values.to_numpy(dtype=float), n_points, downsample)
+        return timestamps.iloc[keep], values.iloc[keep]
+
+    traces = []
+    for label, grp in groups:
+        timestamps, values = grp["Timestamp"], grp[param]
+
+        x, y = downsampled(timestamps, values) if downsample else (timestamps, values)
 
         if label == "Mean":
-            ax.plot(grp["Timestamp"], grp[param], label=label, linewidth=3, c="k")
+            (line,) = ax.plot(x, y, label=label, linewidth=3, c="k")
         else:
-            ax.plot(grp["Timestamp"], grp[param], label=label, linewidth=2)
+            (line,) = ax.plot(x, y, label=label, linewidth=2)
+
+        traces.append((line, timestamps, values))
 
     # ax.set_title(title)
     ax.set_ylabel(f"{param} ({unit})", fontsize=18)
     ax.legend(fontsize=17, loc=4, frameon=True, facecolor="#fff", title="Sensor")
-    format_time_axis()
+    format_time_axis(ax)
 
-    plt.xticks(fontsize=18, rotation=0)
+    ax.tick_params(axis="x", labelsize=18, labelrotation=0)
 
-    plt.tight_layout()
+    fig.tight_layout()
 
     if fig_name:
-        plt.savefig(fig_name, dpi=300, bbox_inches="tight")
+        fig.savefig(fig_name, dpi=SAVE_DPI, bbox_inches="tight")
+
+        # Redraw with fewer points while the saved file is larger than max_bytes
+        while max_bytes and os.path.getsize(fig_name) > max_bytes:
+            if n_points <= 3:
+                raise ValueError(f"{fig_name} does not fit in {max_bytes} bytes")
+
+            n_points = max(3, int(n_points * 0.8))
+            for line, timestamps, values in traces:
+                line.set_data(*downsampled(timestamps, values))
+
+            fig.savefig(fig_name, dpi=SAVE_DPI, bbox_inches="tight")
+
+    if show:
+        plt.show()
+
+    return fig
+
+
+################################
+# BATCH RENDERING
+################################
+
+# A figure to render: plot function, its dataframe, other keyword arguments, the output file and
+# optionally the columns of the dataframe that the figure depends on
+FigureSpec = namedtuple("FigureSpec", ["function", "df", "kwargs", "fig_name", "columns"], defaults=[None])
+
+# Manifest of rendered figures, with their content hash and render time
+FIGURE_MANIFEST = "../results/figure_manifest.json"
+
+# Columns that plot functions read without taking them as an argument
+FIXED_COLUMNS = {
+    "plot_sensor_distributions": ["Sensor"],
+    "plot_sensors_over_time": ["Timestamp", "Sensor"],
+}
+
+
+def render_figure(spec):
+    """Renders a single FigureSpec to its output file.
+
+    The plot functions of this module draw on their own Agg canvas (see headless_figures), so
+    rendering works without a display and leaves the pyplot figures of the caller open.
+    """
+    with headless_figures():
+        fig = spec.function(spec.df, fig_name=spec.fig_name, show=False, **spec.kwargs)
+
+    # Figures created through pyplot by other plot functions
+    plt.close(fig)
+
+    return spec.fig_name
+
+
+def time_render(spec):
+    """Renders a single FigureSpec and returns the render time in seconds."""
+    start = time.perf_counter()
+    render_figure(spec)
+    return time.perf_counter() - start
+
+
+################################
+# FIGURE CACHE
+################################
+
+
+def figure_columns(spec):
+    """Returns the columns of the dataframe that a FigureSpec depends on.
+
+    These are spec.columns when given. Otherwise they are the columns named by string arguments
+    of the plot function, e.g. param, label or dist_col with their defaults, and the columns the
+    function reads by a fixed name. All columns are used when none of these is found.
+    """
+    if spec.columns is not None:
+        return list(spec.columns)
+
+    arguments = {
+        name: parameter.default
+        for name, parameter in inspect.signature(spec.function).parameters.items()
+        if parameter.default is not inspect.Parameter.empty
+    }
+    arguments.update(spec.kwargs)
+
+    names = [value for value in arguments.values() if isinstance(value, str)]
+    names += FIXED_COLUMNS.get(spec.function.__name__, [])
+    columns = [column for column in spec.df.columns if column in names]
+
+    return columns or list(spec.df.columns)
+
+
+def figure_hash(spec):
+    """Returns a content hash of a FigureSpec.
+
+    The hash covers the plot function, its keyword arguments and the values, in order, of the
+    columns the figure depends on. It does not depend on the index or the other columns.
+    """
+    h = hashlib.sha256()
+    h.update(f"{spec.function.__module__}.{spec.function.__qualname__}".encode())
+    h.update(repr(sorted(spec.kwargs.items())).encode())
+
+    for column in figure_columns(spec):
+        values = spec.df[column]
+        h.update(f"{column}:{values.dtype}".encode())
+        h.update(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes())
+
+    return h.hexdigest()
+
+
+def load_figure_manifest(filepath=FIGURE_MANIFEST):
+    """Loads the figure manifest, or an empty manifest if it does not exist yet."""
+    if not os.path.exists(filepath):
+        return {}
+
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def save_figure_manifest(manifest, filepath=FIGURE_MANIFEST):
+    """Saves the figure manifest, replacing the old file only once the new one is written."""
+    folder = os.path.dirname(filepath)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(tmp_path, filepath)
+
+
+def manifest_key(fig_name, manifest_path=FIGURE_MANIFEST):
+    """Returns the path of a figure relative to the manifest folder, used as key in the manifest."""
+    folder = os.path.dirname(os.path.abspath(manifest_path))
+    return os.path.relpath(os.path.abspath(fig_name), folder).replace(os.sep, "/")
+
+
+def stale_figures(specs, manifest, manifest_path=FIGURE_MANIFEST):
+    """Returns the figures whose output is missing or was rendered from different inputs.
+
+    Args:
+        specs (list): Figures as FigureSpec.
+        manifest (dict): Manifest from load_figure_manifest.
+        manifest_path (str, optional): Location of the manifest. Defaults to FIGURE_MANIFEST.
+
+    Returns:
+        list: (FigureSpec, hash) of every figure that has to be rendered.
+    """
+    stale = []
+
+    for spec in specs:
+        digest = figure_hash(spec)
+        entry = manifest.get(manifest_key(spec.fig_name, manifest_path)) if spec.fig_name else None
+
+        if entry is None or entry["hash"] != digest or not os.path.exists(spec.fig_name):
+            stale.append((spec, digest))
+
+    return stale
+
+
+################################
+# INCREMENTAL RENDERING
+################################
+
+
+def render_figures(specs, workers=None, manifest_path=FIGURE_MANIFEST, force=False):
+    """Renders a list of FigureSpec in a process pool, skipping figures that are up to date.
+
+    A figure is up to date when its output file exists and the manifest holds the same hash of
+    the plot function, keyword arguments and data (see figure_hash). The hash, path and render
+    time of every rendered figure are recorded in the manifest.
+
+    Args:
+        specs (list): Figures to render, e.g. FigureSpec(plot_QQ_plots, s_df, {"title": "QQ"}, "qq.pdf").
+        workers (int, optional): Number of worker processes, see util.map_parallel. Defaults to None (all cores).
+        manifest_path (str, optional): Location of the manifest. None renders every figure without
+            a manifest. Defaults to FIGURE_MANIFEST.
+        force (bool, optional): Set to True to render every figure and update the manifest. Defaults to False.
+
+    Returns:
+        list: Output file of every rendered figure.
+    """
+    specs = list(specs)
+
+    if manifest_path is None:
+        return map_parallel(render_figure, specs, workers)
+
+    manifest = load_figure_manifest(manifest_path)
+    stale = [(spec, figure_hash(spec)) for spec in specs] if force else stale_figures(specs, manifest, manifest_path)
+
+    seconds = map_parallel(time_render, [spec for spec, _ in stale], workers)
+    rendered_at = datetime.now().isoformat(timespec="seconds")
+
+    for (spec, digest), render_seconds in zip(stale, seconds):
+        if spec.fig_name:
+            path = manifest_key(spec.fig_name, manifest_path)
+            manifest[path] = {
+                "hash": digest,
+                "path": path,
+                "rendered": rendered_at,
+                "seconds": round(render_seconds, 3),
+            }
+
+    save_figure_manifest(manifest, manifest_path)
 
-    plt.show()
+    return [spec.fig_name for spec, _ in stale]
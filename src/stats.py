@@ -1,7 +1,11 @@
+from functools import partial
+
 import numpy as np
 import pandas as pd
 import scipy.stats as stats
 
+from src.util import map_parallel, get_green_line
+
 ################################
 # CENTRAL TENDENCY
 ################################
@@ -86,7 +90,7 @@ def upperLimit(x):
 
 def outliers(x):
     """Values below lower limit or above upper limit."""
-    return sum([sum(x < lowerLimit(x)), sum(x > upperLimit(x))])
+    return int(((x < lowerLimit(x)) | (x > upperLimit(x))).sum())
 
 
 def prcnt_outliers(x):
@@ -94,33 +98,91 @@ def prcnt_outliers(x):
     return (outliers(x) / len(x)) * 100
 
 
-def print_outliers(s_df, station_quantiles, column):
-    # Get session ids associated with
-    outliers_dict = {}
+def flag_outliers(df, by, column, mask=False):
+    """Flags values below the lower limit or above the upper limit of their group.
+
+    The quartiles of all groups are computed with a single grouped quantile call and
+    broadcast back to the records with the group numbers.
+
+    Args:
+        df (dataframe): Records to screen, e.g. computed sessions.
+        by (str or list): Column(s) to group by, e.g. "Station".
+        column (str): Column with the values, e.g. "PM2.5".
+        mask (bool, optional): Set to True to only return the boolean outlier mask. Defaults to False.
+
+    Returns:
+        series or dataframe: Outlier mask aligned with df, or the Session Id (when present),
+        group and value columns annotated with lowerLimit, upperLimit and outlier.
+    """
+    grouped = df.groupby(by)
+    quartiles = grouped[column].quantile([0.25, 0.75]).unstack().to_numpy()
+
+    # Broadcast the fences of every group back to its records
+    codes = grouped.ngroup().to_numpy()
+    q1 = np.where(codes >= 0, quartiles[codes, 0], np.nan)
+    q3 = np.where(codes >= 0, quartiles[codes, 1], np.nan)
+    lower = q1 - 1.5 * (q3 - q1)
+    upper = q3 + 1.5 * (q3 - q1)
+
+    values = df[column].to_numpy(dtype=float)
+    is_outlier = pd.Series((values < lower) | (values > upper), index=df.index, name="outlier")
+
+    if mask:
+        return is_outlier
+
+    by = [by] if isinstance(by, str) else list(by)
+    columns = (["Session Id"] if "Session Id" in df.columns and "Session Id" not in by else []) + by + [column]
+
+    outliers_df = df[columns].copy()
+    outliers_df["lowerLimit"] = lower
+    outliers_df["upperLimit"] = upper
+    outliers_df["outlier"] = is_outlier
+
+    return outliers_df
 
-    s_of_interest = list(station_quantiles[column].loc[station_quantiles[column].outliers > 0].index)
-    soi_df = s_df.loc[s_df["Station"].isin(s_of_interest)]
 
-    for station, grp in soi_df.groupby("Station"):
-        lower = station_quantiles[column]["lowerLimit"][station]
-        upper = station_quantiles[column]["upperLimit"][station]
-        outliers_dict[station] = grp.loc[(grp[column] <= lower) | (grp[column] >= upper)][["Session Id", column]].values
+def format_outliers(outliers_df, column, by="Station"):
+    """Formats flagged outliers as a report of session ids per group.
 
-    # Print Session id's of interest
-    outlier_ids = []
+    Args:
+        outliers_df (dataframe): Annotated frame from flag_outliers.
+        column (str): Column with the values.
+        by (str, optional): Group column to report under. Defaults to "Station".
 
-    print("=== OUTLIERS ===")
+    Returns:
+        (str, list): The report and the session ids of all outliers.
+    """
+    flagged = outliers_df.loc[outliers_df["outlier"]].sort_values(by, kind="stable")
+    outlier_ids = flagged["Session Id"].tolist()
 
-    for station, sessions in outliers_dict.items():
-        print(f"{station}:")
-        for session in sessions:
+    lines = ["=== OUTLIERS ==="]
 
-            outlier_ids.append(session[0])
-            print(f"\t{session[0]} - {column} = {round(session[1], 2)}")
+    for group, grp in flagged.groupby(by, sort=False):
+        lines.append(f"{group}:")
+        lines += [
+            f"\t{session_id} - {column} = {round(value, 2)}" for session_id, value in grp[["Session Id", column]].values
+        ]
+        lines.append("")
 
-        print()
+    lines.append(f"Unique outliers: {sorted(set(outlier_ids))}")
 
-    print(f"Unique outliers: {sorted(set(outlier_ids))}")
+    return "\n".join(lines), outlier_ids
+
+
+def print_outliers(s_df, station_quantiles, column):
+    """Prints the session ids of values on or outside the station limits in station_quantiles."""
+    stations = station_quantiles[column]
+
+    # Only screen stations with outliers, against their precomputed limits
+    s_of_interest = list(stations.loc[stations.outliers > 0].index)
+    soi_df = s_df.loc[s_df["Station"].isin(s_of_interest), ["Session Id", "Station", column]].copy()
+
+    soi_df["lowerLimit"] = soi_df["Station"].map(stations["lowerLimit"])
+    soi_df["upperLimit"] = soi_df["Station"].map(stations["upperLimit"])
+    soi_df["outlier"] = (soi_df[column] <= soi_df["lowerLimit"]) | (soi_df[column] >= soi_df["upperLimit"])
+
+    report, outlier_ids = format_outliers(soi_df, column)
+    print(report)
 
     return outlier_ids
 
@@ -140,11 +202,443 @@ def kurtosis(x):
     return stats.kurtosis(x, bias=False)
 
 
+################################
+# GROUPED STATISTICS
+################################
+
+# Statistics computed by describe_groups, in output order
+GROUP_STATISTICS = [
+    "count",
+    "mean",
+    "median",
+    "min",
+    "max",
+    "x_range",
+    "sample_std",
+    "standard_error",
+    "CI95",
+    "CV",
+    "Q1",
+    "Q2",
+    "Q3",
+    "IQR",
+    "lowerLimit",
+    "upperLimit",
+    "outliers",
+    "prcnt_outliers",
+    "skew",
+    "kurtosis",
+]
+
+
+def sort_groups(df, by, column):
+    """Sorts the values of column within every group of df with a single np.lexsort.
+
+    Missing values are dropped.
+
+    Args:
+        df (dataframe): Records to group.
+        by (str or list): Column(s) to group by.
+        column (str): Column with the values.
+
+    Returns:
+        (array, array, array, array, index): Sorted values, their group codes, the size and
+        start position of every group, and the group keys.
+    """
+    grouped = df.groupby(by)
+    codes = grouped.ngroup().to_numpy()
+    values = df[column].to_numpy(dtype=float)
+
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes = codes[keep]
+    values = values[keep]
+
+    order = np.lexsort((values, codes))
+    sizes = np.bincount(codes, minlength=grouped.ngroups)
+    starts = np.cumsum(sizes) - sizes
+
+    return values[order], codes[order], sizes, starts, grouped.size().index
+
+
+def sorted_quantile(values, sizes, starts, q):
+    """Linearly interpolated quantile q of every group in values sorted by sort_groups."""
+    position = q * np.maximum(sizes - 1, 0)
+    below = np.floor(position).astype(int)
+    above = np.minimum(below + 1, np.maximum(sizes - 1, 0))
+    t = position - below
+
+    # Empty groups read a valid position and are set to NaN afterwards
+    last = max(len(values) - 1, 0)
+    a = values[np.minimum(starts + below, last)] if len(values) else np.zeros(len(sizes))
+    b = values[np.minimum(starts + above, last)] if len(values) else np.zeros(len(sizes))
+
+    # Interpolate like np.quantile so that results are identical to Series.quantile
+    diff = b - a
+    result = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+    return np.where(sizes > 0, result, np.nan)
+
+
+def describe_groups(df, by, columns):
+    """Computes descriptive statistics of one or more columns for every group in df.
+
+    Every column is sorted once per call, and all quantiles, fences, outlier counts and moments
+    are derived from the sorted values. The results match aggregating the individual functions
+    of this module, e.g. df.groupby(by)[columns].agg([Q1, Q3, outliers, CV, skew, ...]).
+
+    Args:
+        df (dataframe): Records to describe.
+        by (str or list): Column(s) to group by, e.g. "Station".
+        columns (str or list): Column(s) to describe, e.g. "PM2.5" or ["PM2.5", "PM10"].
+
+    Returns:
+        dataframe: One row per group and one column per statistic in GROUP_STATISTICS. When
+        columns is a list, the columns are a (column, statistic) MultiIndex.
+    """
+    frames = {}
+
+    for column in [columns] if isinstance(columns, str) else columns:
+        values, codes, sizes, starts, index = sort_groups(df, by, column)
+        n = sizes.astype(float)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Quantiles and fences
+            q1 = sorted_quantile(values, sizes, starts, 0.25)
+            q2 = sorted_quantile(values, sizes, starts, 0.5)
+            q3 = sorted_quantile(values, sizes, starts, 0.75)
+            iqr = q3 - q1
+            lower = q1 - 1.5 * iqr
+            upper = q3 + 1.5 * iqr
+
+            outlier_count = np.bincount(
+                codes, weights=(values < lower[codes]) | (values > upper[codes]), minlength=len(sizes)
+            ).astype(int)
+
+            # Central moments
+            mean = np.bincount(codes, weights=values, minlength=len(sizes)) / n
+            deviation = values - mean[codes]
+            m2 = np.bincount(codes, weights=deviation**2, minlength=len(sizes)) / n
+            m3 = np.bincount(codes, weights=deviation**3, minlength=len(sizes)) / n
+            m4 = np.bincount(codes, weights=deviation**4, minlength=len(sizes)) / n
+
+            std = np.sqrt(m2 * n / (n - 1))
+
+            # Bias corrected skew and excess kurtosis, like scipy.stats with bias=False
+            zero = m2 <= (np.finfo(float).resolution * mean) ** 2
+            g1 = np.where(zero, np.nan, m3 / m2**1.5)
+            g2 = np.where(zero, np.nan, m4 / m2**2 - 3)
+            skew_value = np.where(n > 2, g1 * np.sqrt(n * (n - 1)) / (n - 2), g1)
+            kurtosis_value = np.where(n > 3, ((n**2 - 1) * m4 / m2**2 - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3)), g2)
+            kurtosis_value = np.where(zero, np.nan, kurtosis_value)
+
+            minimum = np.where(sizes > 0, values[np.minimum(starts, max(len(values) - 1, 0))], np.nan)
+            maximum = np.where(sizes > 0, values[np.maximum(starts + sizes - 1, 0)], np.nan)
+
+            statistics = {
+                "count": sizes,
+                "mean": mean,
+                "median": q2,
+                "min": minimum,
+                "max": maximum,
+                "x_range": maximum - minimum,
+                "sample_std": std,
+                "standard_error": std / np.sqrt(n),
+                "CI95": 1.96 * std / np.sqrt(n),
+                "CV": std / mean,
+                "Q1": q1,
+                "Q2": q2,
+                "Q3": q3,
+                "IQR": iqr,
+                "lowerLimit": lower,
+                "upperLimit": upper,
+                "outliers": outlier_count,
+                "prcnt_outliers": outlier_count / n * 100,
+                "skew": skew_value,
+                "kurtosis": kurtosis_value,
+            }
+
+        frames[column] = pd.DataFrame(statistics, index=index, columns=GROUP_STATISTICS)
+
+    if isinstance(columns, str):
+        return frames[columns]
+
+    return pd.concat(frames, axis=1)
+
+
+################################
+# BOOTSTRAP
+################################
+
+
+def row_mode(samples):
+    """Most common value of every row."""
+    return np.asarray(stats.mode(samples, axis=-1)[0]).reshape(samples.shape[:-1])
+
+
+def row_standard_error(samples):
+    """Sample standard error of every row."""
+    return np.std(samples, ddof=1, axis=-1) / np.sqrt(samples.shape[-1])
+
+
+def row_CI95(samples):
+    """Confidence interval at 95% of every row, like CI95."""
+    return 1.96 * row_standard_error(samples)
+
+
+def row_CV(samples):
+    """Coefficient of variation of every row."""
+    return np.std(samples, ddof=1, axis=-1) / np.mean(samples, axis=-1)
+
+
+def row_limits(samples):
+    """Lower and upper limit of every row, like lowerLimit and upperLimit."""
+    q1, q3 = np.quantile(samples, [0.25, 0.75], axis=-1)
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+
+def row_lower_limit(samples):
+    """Lower limit of every row."""
+    return row_limits(samples)[0]
+
+
+def row_upper_limit(samples):
+    """Upper limit of every row."""
+    return row_limits(samples)[1]
+
+
+def row_IQR(samples):
+    """Inter quartile range of every row."""
+    q1, q3 = np.quantile(samples, [0.25, 0.75], axis=-1)
+    return q3 - q1
+
+
+def row_outliers(samples):
+    """Number of values below the lower limit or above the upper limit in every row."""
+    lower, upper = row_limits(samples)
+    return np.sum((samples < lower[..., np.newaxis]) | (samples > upper[..., np.newaxis]), axis=-1)
+
+
+def row_prcnt_outliers(samples):
+    """Outliers of every row in percent of the row length."""
+    return row_outliers(samples) / samples.shape[-1] * 100
+
+
+# Statistics that can be computed for many resamples at once, along the last axis
+VECTOR_REDUCERS = {
+    "mean": partial(np.mean, axis=-1),
+    "median": partial(np.median, axis=-1),
+    "mode": row_mode,
+    "x_range": partial(np.ptp, axis=-1),
+    "sample_std": partial(np.std, ddof=1, axis=-1),
+    "standard_error": row_standard_error,
+    "CI95": row_CI95,
+    "CV": row_CV,
+    "Q1": partial(np.quantile, q=0.25, axis=-1),
+    "Q2": partial(np.quantile, q=0.5, axis=-1),
+    "Q3": partial(np.quantile, q=0.75, axis=-1),
+    "IQR": row_IQR,
+    "lowerLimit": row_lower_limit,
+    "upperLimit": row_upper_limit,
+    "outliers": row_outliers,
+    "prcnt_outliers": row_prcnt_outliers,
+    "skew": partial(stats.skew, bias=False, axis=-1),
+    "kurtosis": partial(stats.kurtosis, bias=False, axis=-1),
+}
+
+
+def reduce_rows(statistic, samples):
+    """Computes statistic for every row of a 2D array of samples.
+
+    Args:
+        statistic (str or function): Name in VECTOR_REDUCERS, or a function such as CV or IQR.
+            The statistics of this module are computed for all rows at once, other functions
+            are called with every row as a series.
+        samples (array): 2D array with one sample per row.
+
+    Returns:
+        array: statistic of every row.
+    """
+    name = statistic if isinstance(statistic, str) else statistic.__name__
+
+    if name in VECTOR_REDUCERS:
+        return VECTOR_REDUCERS[name](samples)
+
+    if isinstance(statistic, str):
+        raise ValueError(f"Unknown statistic {statistic}")
+
+    return np.array([statistic(pd.Series(row)) for row in samples], dtype=float)
+
+
+def bootstrap_sample(item, statistic="mean", n_resamples=10000, confidence=0.95, method="percentile", max_cells=10**7):
+    """Computes a bootstrap confidence interval for a single sample.
+
+    Resamples are drawn as index matrices of at most max_cells elements, so that memory use
+    is bounded for large samples.
+
+    Args:
+        item (tuple): The sample values and a np.random.SeedSequence for the generator.
+        statistic, n_resamples, confidence, method: See bootstrap_CI.
+        max_cells (int, optional): Largest index matrix drawn at once. Defaults to 10**7.
+
+    Returns:
+        list: Estimate, lower bound and upper bound.
+    """
+    if method not in ("percentile", "bca"):
+        raise ValueError(f"Unknown method {method}, use 'percentile' or 'bca'")
+
+    values, seed = item
+    n = len(values)
+
+    if n == 0:
+        return [np.nan, np.nan, np.nan]
+
+    rng = np.random.default_rng(seed)
+    estimate = reduce_rows(statistic, values[np.newaxis])[0]
+
+    # Statistic of all resamples, drawn as batches of index rows
+    batch = max(1, max_cells // n)
+    replicates = np.concatenate(
+        [
+            reduce_rows(statistic, values[rng.integers(0, n, size=(min(batch, n_resamples - start), n))])
+            for start in range(0, n_resamples, batch)
+        ]
+    )
+
+    tail = (1 - confidence) / 2
+    levels = np.array([tail, 1 - tail])
+
+    if method == "bca":
+        # Bias correction from the share of replicates below the estimate
+        below = np.mean(replicates < estimate) + np.mean(replicates == estimate) / 2
+        z0 = stats.norm.ppf(below)
+
+        # Acceleration from the jackknife, leaving out value i in row i
+        jackknife = np.array([estimate])
+        if n > 1:
+            positions = np.arange(n - 1)
+            jackknife = np.concatenate(
+                [
+                    reduce_rows(statistic, values[positions + (positions >= rows[:, np.newaxis])])
+                    for rows in np.array_split(np.arange(n), -(-n // batch))
+                ]
+            )
+        deviation = jackknife.mean() - jackknife
+        denominator = 6 * np.sum(deviation**2) ** 1.5
+        acceleration = np.sum(deviation**3) / denominator if denominator > 0 else 0.0
+
+        z = stats.norm.ppf(levels)
+        levels = stats.norm.cdf(z0 + (z0 + z) / (1 - acceleration * (z0 + z)))
+
+    if not (np.all(np.isfinite(levels)) and np.any(np.isfinite(replicates))):
+        return [estimate, np.nan, np.nan]
+
+    lower, upper = np.nanquantile(replicates, levels)
+
+    return [estimate, lower, upper]
+
+
+def bootstrap_CI(
+    df, by, column, statistic="mean", n_resamples=10000, confidence=0.95, method="percentile", seed=None, workers=1
+):
+    """Computes bootstrap confidence intervals of a statistic for every group in df.
+
+    Every group gets its own generator spawned from seed, so results do not depend on the
+    number of workers.
+
+    Args:
+        df (dataframe): Records to resample.
+        by (str or list): Column(s) to group by, e.g. "Station".
+        column (str): Column with the values, e.g. "PM2.5".
+        statistic (str or function, optional): Name in VECTOR_REDUCERS or a function of this module. Defaults to "mean".
+        n_resamples (int, optional): Number of resamples per group. Defaults to 10000.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        method (str, optional): "percentile" or "bca" (bias corrected and accelerated). Defaults to "percentile".
+        seed (int, optional): Seed for the random generators. Defaults to None.
+        workers (int, optional): Number of worker processes, see util.map_parallel. Defaults to 1.
+
+    Returns:
+        dataframe: Estimate, lower and upper bound for every group.
+    """
+    values, codes, sizes, starts, index = sort_groups(df, by, column)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    items = [(values[start : start + size], s) for start, size, s in zip(starts, sizes, seeds)]
+
+    function = partial(
+        bootstrap_sample, statistic=statistic, n_resamples=n_resamples, confidence=confidence, method=method
+    )
+    rows = map_parallel(function, items, workers)
+
+    return pd.DataFrame(rows, index=index, columns=["estimate", "lower", "upper"])
+
+
 ################################
 # ANOVA
 ################################
 
 
+def batch_ANOVA(df, params, groupings, alpha=0.1):
+    """Performs a one-way ANOVA for every combination of parameter and grouping.
+
+    The sums of squares of all parameters are computed from a single grouped aggregation
+    (count, mean and variance) per grouping.
+
+    Args:
+        df (dataframe): Records to analyse.
+        params (str or list): Parameter(s) to analyse, e.g. ["PM1.0", "PM2.5", "PM10"].
+        groupings (str or list): Grouping column(s), e.g. ["Sensor", "Station"]. A list or tuple
+            inside groupings groups by several columns at once.
+        alpha (float, optional): Significance level. Defaults to 0.1.
+
+    Returns:
+        dataframe: One row per (Parameter, Grouping) with the sums of squares, degrees of freedom,
+        F statistic, critical F and p-value.
+    """
+    params = [params] if isinstance(params, str) else list(params)
+    groupings = [groupings] if isinstance(groupings, str) else list(groupings)
+    rows = []
+
+    for grouping in groupings:
+        by = [grouping] if isinstance(grouping, str) else list(grouping)
+        label = ", ".join(by)
+
+        # Count, mean and variance of every parameter in every group
+        agg = df.groupby(by)[params].agg(["count", "mean", "var"])
+
+        for param in params:
+            count = agg[(param, "count")].to_numpy(dtype=float)
+            mean = agg[(param, "mean")].to_numpy(dtype=float)
+            var = agg[(param, "var")].to_numpy(dtype=float)
+
+            present = count > 0
+            count, mean, var = count[present], mean[present], var[present]
+
+            grand_mean = np.sum(count * mean) / np.sum(count)
+
+            SSW = np.sum((count - 1) * np.nan_to_num(var))  # Sum of squares within
+            SSB = np.sum(count * (mean - grand_mean) ** 2)  # Sum of squares between
+            SST = SSW + SSB  # Sum of squares total
+
+            SSW_df = int(np.sum(count - 1))
+            SSB_df = len(count) - 1
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                F_statistic = (SSB / SSB_df) / (SSW / SSW_df)
+
+            F_critical = stats.f.ppf(1 - alpha, SSB_df, SSW_df)
+            p_value = stats.f.sf(F_statistic, SSB_df, SSW_df)
+
+            rows.append([param, label, SST, SSW, SSB, SSB_df, SSW_df, alpha, F_statistic, F_critical, p_value])
+
+    columns = ["Parameter", "Grouping", "SST", "SSW", "SSB", "SSB_df", "SSW_df", "Alpha", "F-stat", "F-crit", "P-value"]
+    anova_df = pd.DataFrame(rows, columns=columns).set_index(["Parameter", "Grouping"])
+
+    anova_df["F-stat > F-crit"] = anova_df["F-stat"] > anova_df["F-crit"]
+    anova_df["p-value < alpha"] = anova_df["P-value"] < anova_df["Alpha"]
+
+    return anova_df
+
+
 def perform_ANOVA(df, param="PM2.5", alpha=0.1, group_name="Sensor"):
     def get_SST(df, param="PM2.5"):
         """Computes sum of squares total for a dataframe.
@@ -208,15 +702,151 @@ def perform_ANOVA(df, param="PM2.5", alpha=0.1, group_name="Sensor"):
     F_critical = stats.f.ppf(1 - alpha, SSB_df, SSW_df)
 
     # P-value
-    p_value = 1 - stats.f.cdf(F_statistic, SSB, SSW)
+    p_value = stats.f.sf(F_statistic, SSB_df, SSW_df)
 
     # Combine into dataframe
     headers = ["SST", "SSW", "SSB", "Alpha", "F-stat", "F-crit", "P-value", "F-stat > F-crit", "p-value < alpha"]
     row = [SST, SSW, SSB, alpha, F_statistic, F_critical, p_value, F_statistic > F_critical, p_value < alpha]
 
-    row = [f"{v} (Significant Difference)" if v == True else v for v in row]
-    row = [f"{v} (Failed to reject Null Hypothesis)" if v == False else v for v in row]
+    row = [f"{v} (Significant Difference)" if isinstance(v, (bool, np.bool_)) and v else v for v in row]
+    row = [f"{v} (Failed to reject Null Hypothesis)" if isinstance(v, (bool, np.bool_)) and not v else v for v in row]
 
     anova_df = pd.DataFrame(row, headers)
 
     return anova_df
+
+
+################################
+# PAIRWISE COMPARISON
+################################
+
+
+def adjust_p_values(p_values, method="holm"):
+    """Adjusts p-values for multiple comparisons.
+
+    Args:
+        p_values (array): Unadjusted p-values.
+        method (str, optional): "bonferroni", "holm" or "fdr_bh" (Benjamini-Hochberg). Defaults to "holm".
+
+    Returns:
+        array: Adjusted p-values, in the same order.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    m = len(p_values)
+
+    if method == "bonferroni":
+        return np.minimum(p_values * m, 1)
+
+    if method == "holm":
+        order = np.argsort(p_values)
+        adjusted = np.minimum(np.maximum.accumulate(p_values[order] * (m - np.arange(m))), 1)
+    elif method == "fdr_bh":
+        order = np.argsort(p_values)[::-1]
+        adjusted = np.minimum(np.minimum.accumulate(p_values[order] * m / (m - np.arange(m))), 1)
+    else:
+        raise ValueError(f"Unknown method {method}, use 'bonferroni', 'holm' or 'fdr_bh'")
+
+    result = np.empty(m)
+    result[order] = adjusted
+
+    return result
+
+
+def pairwise_compare(df, group="Station", param="PM2.5", correction="holm"):
+    """Compares every pair of groups with Mann-Whitney U, Welch t and Tukey HSD statistics.
+
+    Values are ranked once: every group is counted per distinct value, and the U statistics,
+    tie corrections and moments of all pairs are computed from these counts with matrix products.
+    Mann-Whitney p-values use the normal approximation with tie and continuity correction.
+
+    Args:
+        df (dataframe): Records to compare.
+        group (str, optional): Column with the groups. Defaults to "Station".
+        param (str, optional): Column with the values. Defaults to "PM2.5".
+        correction (str, optional): Multiple comparison correction of the Mann-Whitney and Welch
+            p-values, see adjust_p_values. Tukey p-values are adjusted by construction. Defaults to "holm".
+
+    Returns:
+        dataframe: One row per group and (statistic, group) columns, so that result["Welch p"] is
+        a group by group matrix. Stations are ordered by get_green_line(). The statistics are
+        "U", "MWU p", "Mean diff", "Welch t", "Welch df", "Welch p", "Tukey q" and "Tukey p",
+        comparing the row group with the column group.
+    """
+    data = df[[group, param]].dropna()
+    values = data[param].to_numpy(dtype=float)
+
+    # Groups in Green Line order, followed by any other groups
+    present = set(data[group].unique())
+    names = [station for station in get_green_line() if station in present]
+    names += sorted(present.difference(names), key=str)
+    codes = pd.Categorical(data[group], categories=names).codes
+
+    # Count every group per distinct value (dense ranks)
+    ranks, uniques = pd.factorize(values, sort=True)
+    C = np.zeros((len(names), len(uniques)))
+    np.add.at(C, (codes, ranks), 1)
+
+    n = C.sum(axis=1)
+    below = np.cumsum(C, axis=1) - C
+
+    # Mann-Whitney U of the row group against the column group
+    U = C @ (below + C / 2).T
+    pair_n = n[:, np.newaxis] + n
+    cubes = (C**3).sum(axis=1)
+    ties = cubes[:, np.newaxis] + cubes + 3 * (C**2 @ C.T) + 3 * (C @ (C**2).T) - pair_n
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = np.outer(n, n) / 2
+        sigma = np.sqrt(np.outer(n, n) / 12 * ((pair_n + 1) - ties / (pair_n * (pair_n - 1))))
+        z = (np.maximum(U, U.T) - mu - 0.5) / sigma
+        mwu_p = np.minimum(2 * stats.norm.sf(z), 1)
+
+        # Welch t test from group means and variances
+        means = C @ uniques / n
+        variances = (C * (uniques - means[:, np.newaxis]) ** 2).sum(axis=1) / (n - 1)
+        se2 = variances / n
+        diff = means[:, np.newaxis] - means
+        welch_t = diff / np.sqrt(se2[:, np.newaxis] + se2)
+        welch_df = (se2[:, np.newaxis] + se2) ** 2 / (
+            se2[:, np.newaxis] ** 2 / (n[:, np.newaxis] - 1) + se2**2 / (n - 1)
+        )
+        welch_p = 2 * stats.t.sf(np.abs(welch_t), welch_df)
+
+        # Tukey HSD from the pooled within group variance
+        k = len(names)
+        total = n.sum()
+        MSW = np.nansum((n - 1) * variances) / (total - k)
+        tukey_q = np.abs(diff) / np.sqrt(MSW / 2 * (1 / n[:, np.newaxis] + 1 / n))
+
+    # The studentized range distribution is slow to evaluate, so only evaluate the unique pairs
+    upper = np.triu_indices(k, 1)
+    tukey_p = np.full((k, k), np.nan)
+    tukey_p[upper] = stats.studentized_range.sf(tukey_q[upper], k, total - k)
+    tukey_p.T[upper] = tukey_p[upper]
+
+    # Correct the p-values of the unique pairs and mirror them
+    for p in (mwu_p, welch_p):
+        valid = ~np.isnan(p[upper])
+        adjusted = p[upper].copy()
+        adjusted[valid] = adjust_p_values(p[upper][valid], correction)
+        p[upper] = adjusted
+        p.T[upper] = adjusted
+
+    matrices = {
+        "U": U,
+        "MWU p": mwu_p,
+        "Mean diff": diff,
+        "Welch t": welch_t,
+        "Welch df": welch_df,
+        "Welch p": welch_p,
+        "Tukey q": tukey_q,
+        "Tukey p": tukey_p,
+    }
+
+    frames = {}
+    for name, matrix in matrices.items():
+        matrix = matrix.astype(float)
+        np.fill_diagonal(matrix, np.nan)
+        frames[name] = pd.DataFrame(matrix, index=names, columns=names)
+
+    return pd.concat(frames, axis=1)
@@ -0,0 +1,321 @@
+"""
+tables.py
+
+Paper tables for Stockholm Air Pollution project.
+
+Statistics frames, e.g. from stats.describe_groups, are written straight to LaTeX, CSV and
+Markdown. Every column is formatted in one vectorized step with its own precision, stations
+are ordered along the green line, and rows are streamed to the output file.
+"""
+
+################################
+# LIBRARIES
+################################
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.calibration import CALIBRATION_FOLDERS
+from src.frames import get_calibrate_df
+from src.stats import describe_groups
+from src.util import create_folder, get_green_line
+
+################################
+# SETTINGS
+################################
+
+# Columns of the key statistics tables of the stations and of the calibration sensors
+KEY_STATS_COLUMNS = ["mean", "median", "sample_std", "CI95", "outliers", "count"]
+CALIBRATION_STATS_COLUMNS = ["mean", "median", "sample_std", "outliers", "count"]
+
+# Decimals of columns that are counts, all other columns get the precision of the table
+COUNT_COLUMNS = {"outliers": 0, "count": 0}
+
+# Shown for missing values, e.g. the standard deviation of a station with a single session
+NA_REP = "-"
+
+# Characters with a special meaning in LaTeX
+LATEX_ESCAPES = {"\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_"}
+
+# Merged sessions the station tables are computed from
+SENSIRION_SESSIONS_PATH = "../results/sessions/sensirion.csv"
+DISC_SESSIONS_PATH = "../results/sessions/disc.csv"
+
+# Output formats by file extension
+TABLE_FORMATS = ["tex", "csv", "md"]
+
+################################
+# TABLE FRAMES
+################################
+
+
+def order_stations(stats_df, order=None):
+    """Sorts a statistics frame indexed by station along a station order.
+
+    Args:
+        stats_df (dataframe): Statistics with one row per station.
+        order (list, optional): Station order. Defaults to util.get_green_line().
+
+    Returns:
+        dataframe: Rows sorted by position in order, with stations outside the order last. The
+        station is stored as an ordered categorical "order" column, as in key_stats.csv of the
+        ToLatex notebook (missing for stations outside the order).
+    """
+    order = order or get_green_line()
+    stations = pd.Categorical(stats_df.index, categories=order, ordered=True)
+
+    # Stations outside the order are sorted after all others, in their original order
+    rank = np.where(stations.codes >= 0, stations.codes, len(order))
+    sorting = np.argsort(rank, kind="stable")
+
+    ordered_df = stats_df.iloc[sorting].copy()
+    ordered_df["order"] = stations[sorting]
+
+    return ordered_df
+
+
+def key_stats(df, column, by="Station", columns=None, order=None):
+    """Returns the key statistics of every group in one grouped pass.
+
+    Args:
+        df (dataframe): Records, e.g. computed sessions.
+        column (str): Column to describe, e.g. "PM2.5" or "Number".
+        by (str, optional): Column to group by. Defaults to "Station".
+        columns (list, optional): Statistics from stats.GROUP_STATISTICS. Defaults to KEY_STATS_COLUMNS.
+        order (list, optional): Group order, see order_stations. Defaults to the green line for
+            stations and to the group keys otherwise.
+
+    Returns:
+        dataframe: The statistics with one row per group, named after by in lower case.
+    """
+    stats_df = describe_groups(df, by, column)[columns or KEY_STATS_COLUMNS]
+
+    if by == "Station" or order is not None:
+        stats_df = order_stations(stats_df, order)
+
+    stats_df.index = stats_df.index.astype(str).rename(by.lower())
+
+    return stats_df
+
+
+################################
+# FORMATTING
+################################
+
+
+def format_columns(stats_df, precision=2, na_rep=NA_REP):
+    """Formats every column of a statistics frame as strings, one vectorized step per column.
+
+    Args:
+        stats_df (dataframe): Numeric statistics.
+        precision (int or dict, optional): Decimals of all columns, or decimals by column name
+            with 2 for columns that are not named. Count columns (COUNT_COLUMNS) get 0 decimals
+            unless named. Defaults to 2.
+        na_rep (str, optional): Text of missing values. Defaults to NA_REP.
+
+    Returns:
+        dataframe: Formatted values with the index and columns of stats_df.
+    """
+    decimals = {**COUNT_COLUMNS, **precision} if isinstance(precision, dict) else COUNT_COLUMNS
+    default = 2 if isinstance(precision, dict) else precision
+
+    formatted = {}
+    for column in stats_df.columns:
+        values = stats_df[column].to_numpy(dtype=float)
+        text = np.char.mod(f"%.{decimals.get(column, default)}f", values)
+        formatted[column] = np.where(np.isnan(values), na_rep, text)
+
+    return pd.DataFrame(formatted, index=stats_df.index)
+
+
+def escape_latex(text):
+    """Escapes the LaTeX special characters of every string in a Series."""
+    for character, replacement in LATEX_ESCAPES.items():
+        text = text.str.replace(character, replacement, regex=False)
+
+    return text
+
+
+def join_columns(formatted_df, first, separator):
+    """Joins the first column and all columns of a formatted frame into one string per row."""
+    rows = first
+    for column in formatted_df.columns:
+        rows = rows + separator + formatted_df[column]
+
+    return rows
+
+
+################################
+# WRITERS
+################################
+
+
+def latex_lines(stats_df, precision=2, columns=None, environment=False, na_rep=NA_REP):
+    """Yields the lines of a LaTeX table.
+
+    Args:
+        stats_df (dataframe): Statistics with one row per group.
+        precision (int or dict, optional): See format_columns. Defaults to 2.
+        columns (list, optional): Columns to include. Defaults to all columns except "order".
+        environment (bool, optional): Set to True to wrap the rows in a tabular environment
+            with a header row. Defaults to False (rows only).
+        na_rep (str, optional): Text of missing values. Defaults to NA_REP.
+
+    Yields:
+        str: Lines without line breaks, e.g. "Alvik & 4.47 & 2.75 & 3.64 & 1.60 & 3 & 20 \\\\".
+    """
+    columns = columns or [c for c in stats_df.columns if c != "order"]
+    formatted_df = format_columns(stats_df[columns], precision, na_rep)
+    names = escape_latex(pd.Series(stats_df.index.astype(str), index=stats_df.index))
+
+    if environment:
+        header = [stats_df.index.name or ""] + list(columns)
+        yield r"\begin{tabular}{l" + "r" * len(columns) + "}"
+        yield r"\hline"
+        yield " & ".join(escape_latex(pd.Series(header, dtype=str))) + r" \\"
+        yield r"\hline"
+
+    yield from join_columns(formatted_df, names, " & ") + r" \\"
+
+    if environment:
+        yield r"\hline"
+        yield r"\end{tabular}"
+
+
+def markdown_lines(stats_df, precision=2, columns=None, na_rep=NA_REP):
+    """Yields the lines of a Markdown table, see latex_lines for the arguments."""
+    columns = columns or [c for c in stats_df.columns if c != "order"]
+    formatted_df = format_columns(stats_df[columns], precision, na_rep)
+    names = pd.Series(stats_df.index.astype(str), index=stats_df.index).str.replace("|", r"\|", regex=False)
+
+    yield "| " + " | ".join([stats_df.index.name or ""] + list(columns)) + " |"
+    yield "| --- |" + " ---: |" * len(columns)
+    yield from "| " + join_columns(formatted_df, names, " | ") + " |"
+
+
+def csv_lines(stats_df, columns=None, chunksize=1000):
+    """Yields the lines of a CSV file with the unrounded statistics, chunksize rows at a time."""
+    columns = columns or list(stats_df.columns)
+
+    for start in range(0, max(len(stats_df), 1), chunksize):
+        chunk = stats_df[columns].iloc[start : start + chunksize]
+        yield from chunk.to_csv(header=start == 0).splitlines()
+
+
+def write_lines(lines, filepath):
+    """Streams lines to a file, creating its folder when needed."""
+    folder = os.path.dirname(filepath)
+    if folder:
+        create_folder(folder)
+
+    with open(filepath, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+    return filepath
+
+
+def write_table(stats_df, filepath, precision=2, columns=None, environment=False, na_rep=NA_REP):
+    """Writes a statistics frame as LaTeX (.tex), CSV (.csv) or Markdown (.md), by file extension.
+
+    Args:
+        stats_df (dataframe): Statistics with one row per group.
+        filepath (str): Output file.
+        precision (int or dict, optional): Decimals of the LaTeX and Markdown values, see
+            format_columns. CSV files keep all decimals. Defaults to 2.
+        columns (list, optional): Columns to include. Defaults to all columns (except "order"
+            in LaTeX and Markdown).
+        environment (bool, optional): Wrap LaTeX rows in a tabular environment. Defaults to False.
+        na_rep (str, optional): Text of missing values. Defaults to NA_REP.
+
+    Returns:
+        str: The output file.
+    """
+    extension = os.path.splitext(filepath)[1].lstrip(".")
+
+    if extension == "tex":
+        lines = latex_lines(stats_df, precision, columns, environment, na_rep)
+    elif extension == "md":
+        lines = markdown_lines(stats_df, precision, columns, na_rep)
+    elif extension == "csv":
+        lines = csv_lines(stats_df, columns)
+    else:
+        raise ValueError(f"Unknown table format {extension}, use one of {TABLE_FORMATS}")
+
+    return write_lines(lines, filepath)
+
+
+def write_tables(stats_df, basepath, formats=None, **kwargs):
+    """Writes a statistics frame in several formats, e.g. basepath.tex, basepath.csv and basepath.md.
+
+    Args:
+        stats_df (dataframe): Statistics with one row per group.
+        basepath (str): Output file without extension.
+        formats (list, optional): File extensions. Defaults to TABLE_FORMATS.
+        **kwargs: Arguments passed on to write_table.
+
+    Returns:
+        list: The output files.
+    """
+    return [write_table(stats_df, f"{basepath}.{extension}", **kwargs) for extension in formats or TABLE_FORMATS]
+
+
+################################
+# PAPER TABLES
+################################
+
+
+def get_paper_tables(s_df=None, disc_df=None, calibrate_df=None):
+    """Computes the key statistics tables of the paper.
+
+    Args:
+        s_df (dataframe, optional): Merged Sensirion sessions. Defaults to SENSIRION_SESSIONS_PATH.
+        disc_df (dataframe, optional): Merged DiSC sessions. Defaults to DISC_SESSIONS_PATH
+            without 2021-10-12.
+        calibrate_df (dataframe, optional): Calibration records of the Sensirion sensors.
+            Defaults to calibration C.
+
+    Returns:
+        dict: (statistics frame, precision) by output path without extension.
+    """
+    if s_df is None:
+        s_df = pd.read_csv(SENSIRION_SESSIONS_PATH)
+
+    if disc_df is None:
+        disc_df = pd.read_csv(DISC_SESSIONS_PATH)
+        disc_df = disc_df.loc[disc_df["Date"] != "2021-10-12"]
+
+    if calibrate_df is None:
+        folder = "../data/calibration_C"
+        calibrate_df = get_calibrate_df(CALIBRATION_FOLDERS[folder], folder)
+
+    green_line = get_green_line()
+    s_df = s_df[s_df["Station"].isin(green_line)]
+    disc_df = disc_df[disc_df["Station"].isin(green_line)]
+
+    return {
+        "../results/stations_sensirion/tables/key_stats": (key_stats(s_df, "PM2.5"), 2),
+        "../results/stations_disc/tables/key_stats": (key_stats(disc_df, "Number"), 0),
+        "../results/calibration_C/tables/key_stats": (
+            key_stats(calibrate_df, "PM2.5", by="Sensor", columns=CALIBRATION_STATS_COLUMNS),
+            2,
+        ),
+    }
+
+
+def write_paper_tables(formats=None, **kwargs):
+    """Computes and writes all key statistics tables of the paper in one call.
+
+    Args:
+        formats (list, optional): File extensions. Defaults to TABLE_FORMATS.
+        **kwargs: Frames passed on to get_paper_tables.
+
+    Returns:
+        list: The output files.
+    """
+    files = []
+    for basepath, (stats_df, precision) in get_paper_tables(**kwargs).items():
+        files += write_tables(stats_df, basepath, formats, precision=precision)
+
+    return files
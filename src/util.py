@@ -7,9 +7,13 @@ General functions for Stockholm Air Pollution project.
 ################################
 # LIBRARIES
 ################################
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import os
 
+import numpy as np
+import pandas as pd
+
 ################################
 # OS FUNCTIONS
 ################################
@@ -18,8 +22,8 @@ import os
 def get_folder_paths(folder_name):
     """Returns a of paths to sub-folders in parent folder."""
 
-    # Get all sub-folders in parent folder
-    folders = [f for f in os.listdir(folder_name) if os.path.isdir(f"{folder_name}/{f}")]
+    # Get all sub-folders in parent folder, sorted so that results are in date order
+    folders = sorted([f for f in os.listdir(folder_name) if os.path.isdir(f"{folder_name}/{f}")])
 
     # Append sub-folder name to parent folder to construct file path
     folders = [f"{folder_name}/{f}" for f in folders]
@@ -35,6 +39,58 @@ def create_folder(folder_name):
     return folder_name
 
 
+def map_parallel(function, items, workers=1):
+    """Applies a function to every item and returns the results in item order.
+
+    Args:
+        function (function): Top-level (picklable) function taking a single item.
+        items (list): Items to process, e.g. folder or file paths.
+        workers (int, optional): Number of worker processes. 1 runs in the current process,
+            None uses all cores. Defaults to 1.
+
+    Returns:
+        list: function(item) for every item.
+    """
+    if workers == 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, items))
+
+
+def count_csv_records(filepath, header_lines=2, chunk_size=1 << 20):
+    """Counts the data rows of a csv file without parsing it.
+
+    The file is scanned in fixed size chunks, so memory use is constant. Blank lines are
+    skipped in the same way as pd.read_csv does.
+
+    Args:
+        filepath (str): Path to csv file.
+        header_lines (int, optional): Number of lines before the first data row. Defaults to 2 (SPS30 files).
+        chunk_size (int, optional): Number of bytes read at a time. Defaults to 1 MB.
+
+    Returns:
+        int: Number of data rows.
+    """
+    lines = 0
+    last = 10  # Treat the start of the file as following a newline
+
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = np.frombuffer(f.read(chunk_size), dtype=np.uint8)
+
+            if len(chunk) == 0:
+                break
+
+            # Count line starts that are not blank (byte after a newline that is not \n or \r)
+            previous = np.concatenate(([last], chunk[:-1]))
+            lines += int(np.count_nonzero((previous == 10) & (chunk != 10) & (chunk != 13)))
+
+            last = chunk[-1]
+
+    return max(lines - header_lines, 0)
+
+
 ################################
 # TIME FUNCTIONS
 ################################
@@ -67,9 +123,8 @@ def format_time(date, time_int):
     # convert int to str
     str_time = str(time_int)
 
-    # Pad 5:00:00 to 05:00:00
-    if len(str_time) < 6:
-        str_time = "0" + str_time
+    # Pad 5:00:00 to 05:00:00, and times after midnight such as 0:04:05 to 00:04:05
+    str_time = str_time.zfill(6)
 
     # Concatenate date and time
     str_time = date + " " + str_time
@@ -80,6 +135,24 @@ def format_time(date, time_int):
     return result
 
 
+def format_times(date, time_ints, offset=timedelta(0)):
+    """Vectorized version of format_time for a whole column of SPS30 times.
+
+    Args:
+        date (str): Current date in format Y-m-d.
+        time_ints (array-like): Times as H%M%S integers, e.g. 84340 for 08:43:40.
+        offset (timedelta, optional): Timezone offset added to every timestamp. Defaults to 0.
+
+    Returns:
+        DatetimeIndex: Timestamps identical to format_time(date, x) + offset for every x.
+    """
+    # Split H%M%S integers into seconds since midnight
+    t = np.asarray(time_ints, dtype=np.int64)
+    seconds = (t // 10000) * 3600 + (t // 100 % 100) * 60 + t % 100
+
+    return pd.Timestamp(date) + pd.to_timedelta(seconds, unit="s") + offset
+
+
 ################################
 # OTHER FUNCTIONS
 ################################
@@ -94,17 +167,52 @@ def evening(x):
 
 
 def get_middle_value(grp, column):
-    # Sort dataframe by column
-    t_df = grp.sort_values(by=[column])
+    """Returns the value that ends up in the middle (index len // 2) when sorting grp by column.
+
+    The value is selected with np.argpartition in linear time instead of sorting the whole group.
+    """
+    values = grp[column].to_numpy()
 
     # Pick out column value in middle
-    n = int(len(t_df) / 2)
+    n = len(values) // 2
 
     # Get the middle record
-    row = t_df.iloc[n]
+    return grp[column].iloc[np.argpartition(values, n)[n]]
+
+
+def get_middle_values(df, by, column):
+    """Returns the get_middle_value of column for every group in df.
+
+    Groups are numbered and all values are ordered with a single np.lexsort, after which the
+    middle of every group is found from the group sizes.
+
+    Args:
+        df (dataframe): Records to group.
+        by (list): Columns to group by.
+        column (str): Column to pick the middle value from.
+
+    Returns:
+        series: Middle value of every group, indexed by the group keys.
+    """
+    grouped = df.groupby(by)
+    codes = grouped.ngroup().to_numpy()
+    values = df[column].to_numpy()
+
+    # Rank strings and other objects, with missing values last like sort_values
+    if values.dtype == object:
+        values, uniques = pd.factorize(values, sort=True)
+        values[values < 0] = len(uniques)
+
+    # Sort by group and then by value, skipping records without a group
+    order = np.lexsort((values, codes))
+    order = order[codes[order] >= 0]
+
+    # Pick out the record in the middle of every group
+    sizes = np.bincount(codes[codes >= 0], minlength=grouped.ngroups)
+    starts = np.cumsum(sizes) - sizes
+    middle = order[starts + sizes // 2]
 
-    # Return
-    return row[column]
+    return pd.Series(df[column].iloc[middle].to_numpy(), index=grouped.size().index, name=column)
 
 
 def get_green_line():